@@ -1,5 +1,6 @@
 from __future__ import absolute_import
 
 from . import datasets
+from . import preprocessing
 
 __version__ = '0.0.1'
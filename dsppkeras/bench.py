@@ -0,0 +1,342 @@
+"""Benchmarks of the data pipeline on synthetic dSPP archives.
+
+Every stage of preparing the dataset for training (load, encode, pad,
+split and batch) is timed for the original, per-protein implementation
+and for the vectorized one, each in a fresh process so that peak memory
+is attributed to a single benchmark. Results are printed or written as
+JSON, to be compared across versions.
+
+Run as
+
+```
+python -m dsppkeras.bench --proteins 5000 --output bench.json
+```
+"""
+from __future__ import absolute_import
+from __future__ import print_function
+
+import argparse
+import collections
+import json
+import multiprocessing
+import os
+import platform
+import shutil
+import sys
+import tarfile
+import tempfile
+import time
+import timeit
+
+import numpy as np
+from six.moves import queue
+
+from . import __version__
+from .datasets import dspp
+from .datasets.synthetic import make_archive
+from .preprocessing.sequence import PaddedBatchGenerator
+from .preprocessing.sequence import encode_proteins
+from .preprocessing.sequence import sequences_to_indices
+from .preprocessing.splitting import train_test_split
+from .utils.instrumentation import peak_rss
+
+
+def _baseline_load(path):
+    """Loads the archive the way `load_data` originally did."""
+    with tarfile.open(path, 'r:gz') as tar:
+        for member in tar.getmembers():
+            f = tar.extractfile(member)
+            if f is not None:
+                database = json.loads(f.read().decode('utf-8'))
+                break
+    X = [np.array(list(x)) for x in database['X']]
+    Y = [np.array(y) for y in database['Y']]
+    return X, Y
+
+
+def _baseline_onehot(sequence):
+    """One-hot encodes a sequence into a flat list, one letter at a time."""
+    encoded = []
+    for letter in sequence:
+        tmp = np.zeros(20)
+        tmp['ACDEFGHIKLMNPQRSTVWY'.index(letter)] = 1
+        encoded.append(tmp)
+    return list(np.asarray(encoded).flatten())
+
+
+def _baseline_pad(sequences, maxlen, dtype='int32'):
+    """Pads sequences one at a time like `keras` `pad_sequences`."""
+    x = np.zeros((len(sequences), maxlen), dtype=dtype)
+    for i, s in enumerate(sequences):
+        if len(s):
+            trunc = np.asarray(s[-maxlen:], dtype=dtype)
+            x[i, -len(trunc):] = trunc
+    return x
+
+
+def _load_json(path, maxlen):
+    return lambda: _baseline_load(path)
+
+
+def _load_build_cache(path, maxlen):
+    def run():
+        tmp_dir = tempfile.mkdtemp(dir=os.path.dirname(path))
+        try:
+            dspp._build_cache(path, os.path.join(tmp_dir, 'cache'))
+        finally:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+    return run
+
+
+def _load_cache(path, maxlen):
+    dspp.load_data(path)
+    return lambda: dspp.load_data(path)
+
+
+def _load_mmap(path, maxlen):
+    dspp.load_dataset(path)
+    return lambda: dspp.load_dataset(path)
+
+
+def _encode_baseline(path, maxlen):
+    X, _ = dspp.load_data(path)
+    return lambda: [_baseline_onehot(x) for x in X]
+
+
+def _encode_vectorized(path, maxlen):
+    dataset = dspp.load_dataset(path, mmap=False)
+
+    def run():
+        # The same flat one-hot vector per protein as the baseline.
+        indices, offsets = sequences_to_indices(dataset.sequences,
+                                                dataset.sequence_offsets)
+        onehot = np.zeros((len(indices), 20))
+        onehot[np.arange(len(indices)), indices] = 1
+        return np.split(onehot.ravel(), 20 * offsets[1:-1])
+    return run
+
+
+def _pad_baseline(path, maxlen):
+    X, Y = dspp.load_data(path)
+    X = [_baseline_onehot(x) for x in X]
+
+    def run():
+        weights = [(y != 0).astype(np.float64) for y in Y]
+        return (_baseline_pad(X, 20 * maxlen),
+                _baseline_pad(Y, maxlen, dtype='float32'),
+                _baseline_pad(weights, maxlen, dtype='float32'))
+    return run
+
+
+def _pad_vectorized(path, maxlen):
+    dataset = dspp.load_dataset(path, mmap=False)
+    return lambda: encode_proteins(dataset.sequences, dataset.propensities,
+                                   dataset.sequence_offsets, maxlen=maxlen)
+
+
+def _split_baseline(path, maxlen):
+    dataset = dspp.load_dataset(path, mmap=False)
+    arrays = encode_proteins(dataset.sequences, dataset.propensities,
+                             dataset.sequence_offsets, maxlen=maxlen)
+
+    def run():
+        indices = np.random.RandomState(123456).permutation(len(dataset))
+        train, test = np.split(indices, [int(len(dataset) * 0.8)])
+        return ([array[train] for array in arrays],
+                [array[test] for array in arrays])
+    return run
+
+
+def _split_indices(path, maxlen):
+    dataset = dspp.load_dataset(path)
+    return lambda: train_test_split(len(dataset), seed=123456)
+
+
+def _batch_generator(bucketing):
+    def setup(path, maxlen):
+        dataset = dspp.load_dataset(path)
+        generator = PaddedBatchGenerator(dataset, maxlen=maxlen,
+                                         bucketing=bucketing, seed=0)
+        return lambda: [generator[i] for i in range(len(generator))]
+    return setup
+
+
+# Setup functions of every `(stage, implementation)`, taking the archive
+# path and `maxlen` and returning the function to time.
+BENCHMARKS = collections.OrderedDict([
+    (('load', 'json'), _load_json),
+    (('load', 'build_cache'), _load_build_cache),
+    (('load', 'cache'), _load_cache),
+    (('load', 'mmap'), _load_mmap),
+    (('encode', 'baseline'), _encode_baseline),
+    (('encode', 'vectorized'), _encode_vectorized),
+    (('pad', 'baseline'), _pad_baseline),
+    (('pad', 'vectorized'), _pad_vectorized),
+    (('split', 'baseline'), _split_baseline),
+    (('split', 'indices'), _split_indices),
+    (('batch', 'generator'), _batch_generator(bucketing=False)),
+    (('batch', 'bucketed'), _batch_generator(bucketing=True)),
+])
+
+STAGES = ('load', 'encode', 'pad', 'split', 'batch')
+
+
+def _measure(setup, path, maxlen, repeat, results):
+    """Times a benchmark, run in a child process."""
+    try:
+        run = setup(path, maxlen)
+        times = [timeit.timeit(run, number=1) for _ in range(repeat)]
+        results.put((times, peak_rss(), None))
+    except Exception as e:
+        results.put((None, None, '{}: {}'.format(type(e).__name__, e)))
+
+
+def run_benchmark(stage, implementation, path, maxlen=800, repeat=3):
+    """Runs a single benchmark in a fresh process.
+
+    # Arguments
+        stage: name of the stage, one of `STAGES`.
+        implementation: name of the implementation, see `BENCHMARKS`.
+        path: path to a dSPP archive.
+        maxlen: length proteins are padded to.
+        repeat: number of timed runs.
+
+    # Returns
+        Dictionary with the best and mean wall time in seconds of the
+        runs, and the peak resident set size in bytes of the process,
+        setup included.
+
+    # Raises
+        RuntimeError: if the benchmark fails, or its process dies, e.g.
+            when killed for running out of memory.
+    """
+    results = multiprocessing.Queue()
+    process = multiprocessing.Process(
+        target=_measure,
+        args=(BENCHMARKS[stage, implementation], path, maxlen, repeat,
+              results))
+    process.start()
+    try:
+        while True:
+            try:
+                times, rss, error = results.get(timeout=1)
+                break
+            except queue.Empty:
+                if process.is_alive():
+                    continue
+                try:
+                    # The result may still be on its way.
+                    times, rss, error = results.get(timeout=1)
+                    break
+                except queue.Empty:
+                    raise RuntimeError(
+                        'Benchmark {}/{} died with exit code {}{}'.format(
+                            stage, implementation, process.exitcode,
+                            ', likely out of memory'
+                            if process.exitcode == -9 else ''))
+    finally:
+        process.join()
+    if error is not None:
+        raise RuntimeError('Benchmark {}/{} failed: {}'.format(
+            stage, implementation, error))
+    return {'seconds': min(times),
+            'mean_seconds': sum(times) / len(times),
+            'peak_rss': rss}
+
+
+def run_benchmarks(path, stages=STAGES, maxlen=800, repeat=3, verbose=1):
+    """Runs the benchmarks of the given stages on an archive.
+
+    # Arguments
+        path: path to a dSPP archive.
+        stages: names of the stages to benchmark.
+        maxlen: length proteins are padded to.
+        repeat: number of timed runs of every benchmark.
+        verbose: whether to print results as they come.
+
+    # Returns
+        List of result dictionaries, one per benchmark, also holding the
+        throughput in proteins and residues per second.
+    """
+    dataset = dspp.load_dataset(path)
+    proteins = len(dataset)
+    residues = int(dataset.lengths.sum())
+    results = []
+    for stage, implementation in BENCHMARKS:
+        if stage not in stages:
+            continue
+        result = collections.OrderedDict([('stage', stage),
+                                          ('implementation', implementation)])
+        result.update(run_benchmark(stage, implementation, path, maxlen,
+                                    repeat))
+        result['proteins_per_second'] = proteins / result['seconds']
+        result['residues_per_second'] = residues / result['seconds']
+        if verbose:
+            print('{:<8}{:<14}{:>10.4f} s {:>12.0f} proteins/s'.format(
+                stage, implementation, result['seconds'],
+                result['proteins_per_second']), file=sys.stderr)
+        results.append(result)
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='python -m dsppkeras.bench',
+        description='Benchmarks the dSPP data pipeline.')
+    parser.add_argument('--archive',
+                        help='dSPP archive to use instead of a synthetic one')
+    parser.add_argument('--proteins', type=int, default=2000,
+                        help='number of synthetic proteins')
+    parser.add_argument('--distribution', default='lognormal',
+                        choices=('lognormal', 'uniform', 'fixed'),
+                        help='length distribution of the synthetic proteins')
+    parser.add_argument('--mean-length', type=int, default=250,
+                        help='mean length of the synthetic proteins')
+    parser.add_argument('--max-length', type=int,
+                        help='length of the longest synthetic proteins')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='random seed of the synthetic archive')
+    parser.add_argument('--stages', nargs='+', choices=STAGES,
+                        default=list(STAGES), help='stages to benchmark')
+    parser.add_argument('--maxlen', type=int, default=800,
+                        help='length proteins are padded to')
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='timed runs of every benchmark')
+    parser.add_argument('--output', help='file to write the JSON report to')
+    args = parser.parse_args(argv)
+
+    tmp_dir = tempfile.mkdtemp(prefix='dspp-bench-')
+    try:
+        if args.archive is None:
+            path = make_archive(os.path.join(tmp_dir, 'dspp.tar.gz'),
+                                num_proteins=args.proteins,
+                                distribution=args.distribution,
+                                mean_length=args.mean_length,
+                                max_length=args.max_length, seed=args.seed)
+        else:
+            path = os.path.join(tmp_dir, os.path.basename(args.archive))
+            shutil.copy(args.archive, path)
+        results = run_benchmarks(path, stages=args.stages,
+                                 maxlen=args.maxlen, repeat=args.repeat)
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    report = collections.OrderedDict([
+        ('time', time.strftime('%Y-%m-%dT%H:%M:%S%z')),
+        ('environment', collections.OrderedDict([
+            ('dsppkeras', __version__),
+            ('numpy', np.__version__),
+            ('python', platform.python_version()),
+            ('platform', platform.platform()),
+            ('cpus', multiprocessing.cpu_count())])),
+        ('config', vars(args)),
+        ('results', results)])
+    if args.output is None:
+        print(json.dumps(report, indent=2))
+    else:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
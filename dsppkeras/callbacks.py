@@ -0,0 +1,84 @@
+"""Keras callbacks reporting on the data pipeline."""
+from __future__ import absolute_import
+
+import timeit
+
+from keras.callbacks import Callback
+
+from .utils import instrumentation
+
+
+class PipelineTimings(Callback):
+    """Adds the time the training loop waits for data to the epoch logs.
+
+    `data_stall_seconds` is measured in the training loop itself: the
+    time from the end of one batch, or the start of the epoch, to the
+    start of the next batch, which is spent waiting for the generator and
+    in other callbacks. It is right however batches are produced, in
+    threads or in processes.
+
+    While training, the timers of `dsppkeras.utils.instrumentation` are
+    also enabled, and the seconds spent in every stage of `stages` in this
+    process during the epoch are added to the logs as `<stage>_seconds`.
+    Stages running in enqueuer threads overlap training, and those of
+    worker processes are not seen at all.
+
+    Keras does not end training with `on_train_end` after an error, so the
+    callback can be used as a context manager to always stop the timers.
+
+    # Arguments
+        stages: names of the timed stages to report.
+
+    # Example
+
+    ```python
+        generator = PaddedBatchGenerator(dspp.load_dataset())
+        with PipelineTimings() as timings:
+            history = model.fit_generator(generator, epochs=10,
+                                          callbacks=[timings])
+        print(history.history['data_stall_seconds'])
+    ```
+    """
+
+    def __init__(self, stages=('batch', 'loader.wait')):
+        super(PipelineTimings, self).__init__()
+        self.stages = stages
+        self.summary = instrumentation.SummarySink()
+        self.stall = 0.
+        self.waiting_since = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        instrumentation.remove_sink(self.summary)
+
+    def on_train_begin(self, logs=None):
+        # Registered once, even if an earlier run ended in an error.
+        instrumentation.remove_sink(self.summary)
+        instrumentation.add_sink(self.summary)
+
+    def on_epoch_begin(self, epoch, logs=None):
+        self.summary.reset()
+        self.stall = 0.
+        self.waiting_since = timeit.default_timer()
+
+    def on_batch_begin(self, batch, logs=None):
+        if self.waiting_since is not None:
+            self.stall += timeit.default_timer() - self.waiting_since
+            self.waiting_since = None
+
+    def on_batch_end(self, batch, logs=None):
+        self.waiting_since = timeit.default_timer()
+
+    def on_epoch_end(self, epoch, logs=None):
+        self.waiting_since = None
+        if logs is None:
+            return
+        for stage in self.stages:
+            logs[stage.replace('.', '_') + '_seconds'] = \
+                self.summary.seconds[stage]
+        logs['data_stall_seconds'] = self.stall
+
+    def on_train_end(self, logs=None):
+        instrumentation.remove_sink(self.summary)
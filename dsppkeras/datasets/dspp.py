@@ -1,31 +1,601 @@
-from ..utils.data_utils import get_file
+from ..utils import instrumentation
+from ..utils.data_utils import FileLock
+from ..utils.data_utils import get_file, open_archive_member, _hash_file
+from ..utils.data_utils import get_cache_dir
 import numpy as np
+import hashlib
 import json
-import tarfile
 import codecs
+import collections
+import copy
+import glob
+import os
+import re
+import shutil
+import tempfile
+import six
 
-def load_data(path='peptone_dspp.tar.gz'):
-    """Loads the MNIST dataset.
+_ORIGIN = 'https://github.com/PeptoneInc/dspp-data/blob/master/database.tar.gz?raw=true'
+
+# Bump whenever the layout of the binary cache changes.
+_CACHE_VERSION = 3
+_CACHE_ARRAYS = ('sequences', 'sequence_offsets',
+                 'propensities', 'propensity_offsets', 'stats')
+# Optional arrays, only present when the archive provides the field.
+_OPTIONAL_CACHE_ARRAYS = ('ids',)
+
+
+_WHITESPACE = re.compile(r'[ \t\n\r]*')
+# Characters which may follow a complete JSON value.
+_DELIMITERS = ' \t\n\r,:]}'
+
+
+class _JSONArrayStream(object):
+    """Incremental parser for the arrays of a top-level JSON object.
+
+    Reads `{"key": [item, ...], ...}` from a binary file object a chunk at
+    a time and decodes one array item at a time, so that neither the raw
+    bytes nor the decoded document are ever held in memory as a whole.
+    Top-level values which are not arrays are skipped.
+
+    # Arguments
+        f: binary file object holding UTF-8 encoded JSON.
+        chunk_size: bytes to read at a time.
+    """
+
+    def __init__(self, f, chunk_size=1 << 16):
+        self.f = f
+        self.chunk_size = chunk_size
+        self.decoder = json.JSONDecoder()
+        self.utf8 = codecs.getincrementaldecoder('utf-8')()
+        self.buffer = ''
+        self.pos = 0
+        self.eof = False
+
+    def _fill(self):
+        """Reads another chunk, returns False at the end of the file."""
+        if self.eof:
+            return False
+        data = self.f.read(self.chunk_size)
+        self.eof = not data
+        self.buffer = self.buffer[self.pos:] + self.utf8.decode(data,
+                                                                self.eof)
+        self.pos = 0
+        return True
+
+    def _peek(self):
+        """Returns the next non-whitespace character."""
+        while True:
+            self.pos = _WHITESPACE.match(self.buffer, self.pos).end()
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self._fill():
+                raise ValueError('Unexpected end of JSON document')
+
+    def _expect(self, characters):
+        character = self._peek()
+        if character not in characters:
+            raise ValueError('Expected one of {!r} at {!r} in JSON '
+                             'document'.format(characters, character))
+        self.pos += 1
+        return character
+
+    def _value(self):
+        """Decodes the next complete JSON value."""
+        self._peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.pos)
+                # A value not yet followed by a delimiter, such as the
+                # digits of a number read so far, may continue in the next
+                # chunk.
+                if self.eof or (end < len(self.buffer) and
+                                self.buffer[end] in _DELIMITERS):
+                    self.pos = end
+                    return value
+            except ValueError:
+                if self.eof:
+                    raise
+            self._fill()
+
+    def __iter__(self):
+        """Yields `(key, item)` for every item of every top-level array."""
+        self._expect('{')
+        if self._peek() == '}':
+            return
+        while True:
+            key = self._value()
+            self._expect(':')
+            if self._peek() != '[':
+                self._value()
+            else:
+                self.pos += 1
+                if self._peek() == ']':
+                    self.pos += 1
+                else:
+                    while True:
+                        yield key, self._value()
+                        if self._expect(',]') == ']':
+                            break
+            if self._expect(',}') == '}':
+                return
+
+
+class _GrowableArray(object):
+    """One-dimensional array with amortized constant time appends."""
+
+    def __init__(self, dtype, capacity=1024):
+        self.data = np.empty(capacity, dtype=dtype)
+        self.size = 0
+
+    def extend(self, values):
+        end = self.size + len(values)
+        if end > len(self.data):
+            data = np.empty(max(end, 2 * len(self.data)),
+                            dtype=self.data.dtype)
+            data[:self.size] = self.data[:self.size]
+            self.data = data
+        self.data[self.size:end] = values
+        self.size = end
+
+    def array(self):
+        return self.data[:self.size]
+
+
+def _open_database(path):
+    """Returns a file object for the JSON member of the dSPP archive.
+
+    The member is found through the index of the archive (see
+    `data_utils.index_archive`), so the archive is not scanned.
+    """
+    try:
+        return open_archive_member(path)
+    except KeyError:
+        raise ValueError('No dSPP database found in {}'.format(path))
+
+
+def _iter_items(path):
+    """Streams `(key, item)` pairs of the arrays in the dSPP archive."""
+    with _open_database(path) as f:
+        for key, item in _JSONArrayStream(f):
+            yield key, item
+
+
+def iter_records(path='peptone_dspp.tar.gz', store=None):
+    """Iterates over the proteins of the dSPP archive without loading it.
+
+    The archive is parsed as a stream. Proteins are yielded as soon as both
+    their sequence and propensities have been read; whichever of the two
+    arrays comes first in the archive is held in compact form meanwhile.
+
+    # Arguments
+        path: path where to cache the dataset locally
+            (relative to ~/.keras/datasets).
+        store: a `cache_utils.ContentStore` keeping the archive and its
+            binary cache under the digest of the archive.
+
+    # Returns
+        A generator of `(sequence, propensities)` tuples, with the sequence
+        as a string and the propensities as a `float32` array.
+    """
+    path = get_file(path, origin=_ORIGIN, store=store)
+    pending = {'X': collections.deque(), 'Y': collections.deque()}
+    for key, item in _iter_items(path):
+        if key == 'Y':
+            item = np.asarray(item, dtype=np.float32)
+        elif key != 'X':
+            continue
+        other = pending['Y' if key == 'X' else 'X']
+        if not other:
+            pending[key].append(item)
+        elif key == 'X':
+            yield item, other.popleft()
+        else:
+            yield other.popleft(), item
+    if pending['X'] or pending['Y']:
+        raise ValueError('The dSPP archive has a different number of '
+                         'sequences and propensities.')
+
+
+def _offsets(lengths):
+    """Turns per-protein lengths into an `(N + 1,)` array of offsets."""
+    offsets = np.zeros(len(lengths) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=offsets[1:])
+    return offsets
+
+
+def _propensity_stats(propensities, offsets):
+    """Summarizes the propensities of every protein.
+
+    Only residues with an experimental assignment, i.e. a non-zero
+    propensity, are taken into account.
+
+    # Arguments
+        propensities: concatenated `float32` propensities.
+        offsets: `(N + 1,)` offsets of the proteins into `propensities`.
+
+    # Returns
+        Structured array with the `length`, assignment `coverage` and the
+        `mean`, `std`, `min` and `max` propensity of every protein. The
+        statistics are NaN for proteins without any assignment.
+    """
+    lengths = np.diff(offsets)
+    rows = np.repeat(np.arange(len(lengths)), lengths)
+    assigned = propensities != 0
+    count = np.bincount(rows, weights=assigned, minlength=len(lengths))
+    total = np.bincount(rows, weights=propensities, minlength=len(lengths))
+    squares = np.bincount(rows, weights=np.square(propensities,
+                                                  dtype=np.float64),
+                          minlength=len(lengths))
+
+    stats = np.zeros(len(lengths), dtype=[
+        ('length', np.int32), ('coverage', np.float32),
+        ('mean', np.float32), ('std', np.float32),
+        ('min', np.float32), ('max', np.float32)])
+    stats['length'] = lengths
+    with np.errstate(divide='ignore', invalid='ignore'):
+        stats['coverage'] = count / lengths
+        mean = total / count
+        stats['mean'] = mean
+        stats['std'] = np.sqrt(np.maximum(squares / count - mean ** 2, 0))
+    # Empty proteins reduce over the sentinel appended at the end.
+    starts = np.minimum(offsets[:-1], len(propensities))
+    for name, reduce, sentinel in (('min', np.minimum, np.inf),
+                                   ('max', np.maximum, -np.inf)):
+        values = np.append(np.where(assigned, propensities, sentinel),
+                           sentinel)
+        extreme = reduce.reduceat(values, starts)
+        extreme[count == 0] = np.nan
+        stats[name] = extreme
+    return stats
+
+
+def _cache_prefix(path):
+    """Common prefix of the binary caches of the archive at `path`.
+
+    Caches are kept next to the archive, or in the `dspp-cache` subdir of
+    the Keras cache dir when the directory of the archive is read-only.
+    """
+    dirname = os.path.dirname(os.path.abspath(path))
+    if os.access(dirname, os.W_OK):
+        return path
+    path_digest = hashlib.sha1(
+        os.path.abspath(path).encode('utf-8')).hexdigest()[:8]
+    return os.path.join(get_cache_dir('dspp-cache'), '{}.{}'.format(
+        os.path.basename(path), path_digest))
+
+
+def _cache_path(path, digest):
+    """Location of the binary cache belonging to the archive at `path`."""
+    return '{}.{}.v{}.cache'.format(_cache_prefix(path), digest[:16],
+                                    _CACHE_VERSION)
+
+
+def _build_cache(path, cache_path):
+    """Converts the archive at `path` into the binary cache layout.
+
+    Sequences are stored as one concatenated `uint8` buffer of ASCII letter
+    codes and propensities as one concatenated `float32` buffer, each with
+    an `int64` offsets array delimiting the proteins. Entry IDs are kept
+    when the archive has an `ID` field, and per-protein statistics (see
+    `_propensity_stats`) serve as an index for selecting proteins. The
+    archive is parsed as a stream straight into these buffers.
+
+    # Arguments
+        path: path to the `tar.gz` archive.
+        cache_path: directory the cache is written to.
+    """
+    sequences = _GrowableArray(np.uint8)
+    propensities = _GrowableArray(np.float32)
+    lengths = {'X': [], 'Y': []}
+    ids = []
+    with instrumentation.timer('parse', path=path) as stage:
+        for key, item in _iter_items(path):
+            if key == 'X':
+                sequences.extend(np.frombuffer(item.encode('ascii'),
+                                               dtype=np.uint8))
+            elif key == 'Y':
+                propensities.extend(item)
+            elif key == 'ID':
+                ids.append(item)
+                continue
+            else:
+                continue
+            lengths[key].append(len(item))
+        stage.update(proteins=len(lengths['X']),
+                     residues=int(sum(lengths['X'])))
+    instrumentation.count('parse.proteins', len(lengths['X']), path=path)
+    instrumentation.count('parse.residues', len(sequences.array()),
+                          path=path)
+
+    arrays = {'sequences': sequences.array(),
+              'sequence_offsets': _offsets(lengths['X']),
+              'propensities': propensities.array(),
+              'propensity_offsets': _offsets(lengths['Y'])}
+    arrays['stats'] = _propensity_stats(arrays['propensities'],
+                                        arrays['propensity_offsets'])
+    if ids:
+        arrays['ids'] = np.array(ids, dtype=np.str_)
+    _write_cache(arrays, cache_path)
+
+    # Caches built from earlier versions of the archive are now stale.
+    for stale in glob.glob('{}.*.v*.cache'.format(_cache_prefix(path))):
+        if stale != cache_path:
+            shutil.rmtree(stale, ignore_errors=True)
+
+
+def _write_cache(arrays, cache_path):
+    """Writes the arrays of a binary cache into the directory `cache_path`.
+
+    # Arguments
+        arrays: dictionary of the arrays named in `_CACHE_ARRAYS` and
+            optionally `_OPTIONAL_CACHE_ARRAYS`.
+        cache_path: directory the cache is written to.
+    """
+    # Write next to the final location and rename, so that an interrupted
+    # conversion never leaves a half-written cache behind.
+    tmp_path = tempfile.mkdtemp(dir=os.path.dirname(cache_path),
+                                prefix='.dspp-cache-')
+    try:
+        for name, array in arrays.items():
+            np.save(os.path.join(tmp_path, name + '.npy'), array)
+        os.rename(tmp_path, cache_path)
+    except OSError:
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        if not os.path.isdir(cache_path):
+            raise
+
+
+def _ensure_cache(path):
+    """Returns the binary cache directory of the archive, building it if needed.
+
+    Processes starting together build the cache once: the first one takes
+    a lock while building, the others wait for it and use its cache.
+
+    # Arguments
+        path: path to the `tar.gz` archive.
+
+    # Returns
+        Path to the cache directory.
+    """
+    cache_path = _cache_path(path, _hash_file(path, algorithm='sha256'))
+    if not os.path.isdir(cache_path):
+        with FileLock(path + '.cache.lock'):
+            if not os.path.isdir(cache_path):
+                _build_cache(path, cache_path)
+                return cache_path
+    instrumentation.count('cache.hits', path=path)
+    return cache_path
+
+
+def _load_cache(cache_path, mmap_mode=None):
+    """Loads the arrays of a binary cache directory.
+
+    # Arguments
+        cache_path: path to the cache directory.
+        mmap_mode: passed on to `np.load`.
+
+    # Returns
+        Dictionary of the cached arrays.
+    """
+    arrays = {}
+    for name in _CACHE_ARRAYS + _OPTIONAL_CACHE_ARRAYS:
+        fname = os.path.join(cache_path, name + '.npy')
+        if name in _CACHE_ARRAYS or os.path.exists(fname):
+            arrays[name] = np.load(fname, mmap_mode=mmap_mode)
+    return arrays
+
+
+class DSPPDataset(object):
+    """Random access view of the dSPP dataset backed by its binary cache.
+
+    With `mmap_mode` set, proteins are views into memory-mapped buffers,
+    so processes opening the same cache share a single page-cache copy.
+    Pickling a dataset only transfers the cache location.
+
+    A dataset may be restricted to a subset of the proteins with `subset`,
+    typically found with `select`, which queries precomputed per-protein
+    statistics instead of scanning the propensities.
+
+    # Arguments
+        cache_path: path to the binary cache directory.
+        mmap_mode: passed on to `np.load`, `None` reads the cache into memory.
+        indices: positions of the proteins in the cache this dataset is
+            restricted to, `None` for all of them.
+
+    # Example
+
+    ```python
+        dataset = dspp.load_dataset()
+        x, y = dataset[0]
+        x, y = dataset['dSPP27058_0']
+        short = dataset.subset(dataset.select(max_length=300))
+    ```
+    """
+
+    def __init__(self, cache_path, mmap_mode='r', indices=None):
+        self.cache_path = cache_path
+        self.mmap_mode = mmap_mode
+        arrays = _load_cache(cache_path, mmap_mode=mmap_mode)
+        self.sequences = arrays['sequences']
+        self.sequence_offsets = np.asarray(arrays['sequence_offsets'])
+        self.propensities = arrays['propensities']
+        self.propensity_offsets = np.asarray(arrays['propensity_offsets'])
+        self._stats = arrays['stats']
+        self._ids = arrays.get('ids')
+        self.indices = None
+        if indices is not None:
+            self.indices = np.asarray(indices, dtype=np.int64)
+        self._id_index = None
+
+    def __getstate__(self):
+        return {'cache_path': self.cache_path, 'mmap_mode': self.mmap_mode,
+                'indices': self.indices}
+
+    def __setstate__(self, state):
+        self.__init__(**state)
+
+    def __len__(self):
+        if self.indices is not None:
+            return len(self.indices)
+        return len(self.sequence_offsets) - 1
+
+    def __getitem__(self, key):
+        """Returns `(sequence, propensities)` of a protein.
+
+        # Arguments
+            key: position of the protein, or its dSPP entry ID.
+
+        # Returns
+            Tuple of views: the `uint8` ASCII letter codes and the
+            `float32` propensities.
+        """
+        i = self.index(key)
+        if self.indices is not None:
+            i = self.indices[i]
+        return (self.sequences[self.sequence_offsets[i]:
+                               self.sequence_offsets[i + 1]],
+                self.propensities[self.propensity_offsets[i]:
+                                  self.propensity_offsets[i + 1]])
+
+    def _view(self, array):
+        if array is None or self.indices is None:
+            return array
+        return array[self.indices]
+
+    @property
+    def ids(self):
+        """dSPP entry IDs of the proteins, `None` if the archive has none."""
+        return self._view(self._ids)
+
+    @property
+    def stats(self):
+        """Per-protein statistics, see `_propensity_stats`."""
+        return self._view(self._stats)
+
+    @property
+    def lengths(self):
+        """Number of residues of every protein."""
+        return self._view(np.diff(self.sequence_offsets))
+
+    def index(self, key):
+        """Resolves a position or a dSPP entry ID to a position.
+
+        # Arguments
+            key: position of the protein, or its dSPP entry ID.
+
+        # Returns
+            Non-negative position of the protein.
+
+        # Raises
+            IndexError: if the position is out of range.
+            KeyError: if the entry ID is unknown.
+        """
+        if isinstance(key, six.string_types):
+            if self._id_index is None:
+                if self._ids is None:
+                    raise KeyError('The dSPP archive has no entry IDs, '
+                                   'cannot look up {}'.format(key))
+                self._id_index = dict((entry_id, i) for i, entry_id
+                                      in enumerate(self.ids.tolist()))
+            return self._id_index[key]
+        n = len(self)
+        i = int(key)
+        if i < 0:
+            i += n
+        if not 0 <= i < n:
+            raise IndexError('Protein index {} out of range for a dataset '
+                             'of {} proteins'.format(key, n))
+        return i
+
+    def sequence(self, key):
+        """Returns the amino acid sequence of a protein as a string."""
+        return self[key][0].tobytes().decode('ascii')
+
+    def select(self, min_length=None, max_length=None, min_coverage=None,
+               min_mean=None, max_mean=None):
+        """Finds the proteins matching all of the given criteria.
+
+        Proteins without any assigned residue never match criteria on
+        their mean propensity.
+
+        # Arguments
+            min_length: minimum number of residues.
+            max_length: maximum number of residues.
+            min_coverage: minimum fraction of residues with a propensity.
+            min_mean: minimum mean propensity.
+            max_mean: maximum mean propensity.
+
+        # Returns
+            Array of the positions of the matching proteins.
+        """
+        stats = self.stats
+        mask = np.ones(len(stats), dtype=bool)
+        for field, bound, compare in (('length', min_length, np.greater_equal),
+                                      ('length', max_length, np.less_equal),
+                                      ('coverage', min_coverage,
+                                       np.greater_equal),
+                                      ('mean', min_mean, np.greater_equal),
+                                      ('mean', max_mean, np.less_equal)):
+            if bound is not None:
+                mask &= compare(stats[field], bound)
+        return np.flatnonzero(mask)
+
+    def subset(self, indices):
+        """Restricts the dataset to some of its proteins, without copying.
+
+        # Arguments
+            indices: positions of the proteins to keep.
+
+        # Returns
+            A `DSPPDataset` sharing the buffers of this one.
+        """
+        indices = np.asarray(indices, dtype=np.int64)
+        if self.indices is not None:
+            indices = self.indices[indices]
+        dataset = copy.copy(self)
+        dataset.indices = indices
+        dataset._id_index = None
+        return dataset
+
+
+def load_dataset(path='peptone_dspp.tar.gz', mmap=True, store=None):
+    """Loads the dSPP dataset as a `DSPPDataset`.
 
     # Arguments
         path: path where to cache the dataset locally
             (relative to ~/.keras/datasets).
+        mmap: whether to memory-map the binary cache instead of
+            reading it into memory.
+        store: a `cache_utils.ContentStore` keeping the archive and its
+            binary cache under the digest of the archive.
 
     # Returns
-        Tuple of Numpy arrays: `(x_train, y_train), (x_test, y_test)`.
-    """
-    path = get_file(path, origin='https://github.com/PeptoneInc/dspp-data/blob/master/database.tar.gz?raw=true')
-    tar = tarfile.open(path, "r:gz")
-    #print("Open archive at {}".format(path))
-    for member in tar.getmembers():
-         f = tar.extractfile(member)
-         if f is None: continue
-         content = f.read()
-         #print("Load json {}".format(f))
-         database = json.loads(content.decode('utf-8'))
-         break
-
-    X, Y = database['X'], database['Y']
-    f.close()
-    X, Y = map(lambda element: np.array(list(element)), X), map(lambda element: np.array(element), Y)
-    return list(X), list(Y)
+        A `DSPPDataset`.
+    """
+    path = get_file(path, origin=_ORIGIN, store=store)
+    return DSPPDataset(_ensure_cache(path), mmap_mode='r' if mmap else None)
+
+
+def load_data(path='peptone_dspp.tar.gz', store=None):
+    """Loads the dSPP dataset.
+
+    The archive is parsed once and converted into a binary cache stored
+    next to it; subsequent calls only read the cache.
+
+    # Arguments
+        path: path where to cache the dataset locally
+            (relative to ~/.keras/datasets).
+        store: a `cache_utils.ContentStore` keeping the archive and its
+            binary cache under the digest of the archive.
+
+    # Returns
+        Tuple of lists `(X, Y)`: the amino acid sequences as arrays of
+        one letter codes and the per-residue propensities.
+    """
+    path = get_file(path, origin=_ORIGIN, store=store)
+    cache = _load_cache(_ensure_cache(path))
+    letters = cache['sequences'].view('S1').astype('U1')
+    X = np.split(letters, cache['sequence_offsets'][1:-1])
+    Y = np.split(cache['propensities'], cache['propensity_offsets'][1:-1])
+    return X, Y
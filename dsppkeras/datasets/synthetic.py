@@ -0,0 +1,207 @@
+"""Synthetic datasets shaped like dSPP, for offline and scale testing."""
+from __future__ import absolute_import
+
+import json
+import os
+import shutil
+import tarfile
+import tempfile
+
+import numpy as np
+
+from . import dspp
+from ..preprocessing.sequence import AMINO_ACIDS
+from ..utils.data_utils import _hash_file
+
+_LETTERS = np.frombuffer(AMINO_ACIDS.encode('ascii'), dtype=np.uint8)
+
+# Residues generated at a time, bounding the memory used for large sets.
+_BLOCK_RESIDUES = 1 << 22
+
+
+def protein_lengths(num_proteins, distribution='lognormal', mean_length=250,
+                    min_length=5, max_length=None, seed=None):
+    """Draws the lengths of synthetic proteins.
+
+    # Arguments
+        num_proteins: number of proteins.
+        distribution: 'lognormal' for the skewed distribution of real
+            proteins, 'uniform' or 'fixed'.
+        mean_length: mean length before clipping.
+        min_length: length of the shortest proteins.
+        max_length: length of the longest proteins, `None` for no limit.
+        seed: random seed.
+
+    # Returns
+        `int64` array of lengths.
+    """
+    random = np.random.RandomState(seed)
+    if distribution == 'lognormal':
+        sigma = 0.6
+        mu = np.log(mean_length) - sigma ** 2 / 2
+        lengths = random.lognormal(mu, sigma, size=num_proteins)
+    elif distribution == 'uniform':
+        lengths = random.uniform(min_length, 2 * mean_length - min_length,
+                                 size=num_proteins)
+    elif distribution == 'fixed':
+        lengths = np.full(num_proteins, mean_length)
+    else:
+        raise ValueError('Unknown length distribution: ' + str(distribution))
+    lengths = np.maximum(lengths.astype(np.int64), min_length)
+    if max_length is not None:
+        lengths = np.minimum(lengths, max_length)
+    return lengths
+
+
+def _blocks(lengths, coverage, seed):
+    """Generates proteins in blocks of concatenated residues.
+
+    # Returns
+        A generator of `(lengths, sequences, propensities)`: the lengths of
+        a block of proteins, their `uint8` ASCII letter codes and their
+        propensities rounded to three decimals, unassigned ones being 0.
+    """
+    random = np.random.RandomState(seed)
+    offsets = dspp._offsets(lengths)
+    start = 0
+    while start < len(lengths):
+        stop = max(np.searchsorted(offsets, offsets[start] + _BLOCK_RESIDUES,
+                                   side='right') - 1, start + 1)
+        block = lengths[start:stop]
+        total = int(block.sum())
+        sequences = _LETTERS[random.randint(len(_LETTERS), size=total)]
+        propensities = np.round(np.clip(random.normal(0, 0.5, size=total),
+                                        -1, 1), 3)
+        propensities[random.uniform(size=total) >= coverage] = 0
+        yield block, sequences, propensities
+        start = stop
+
+
+def _write_array(f, key, items):
+    """Writes `"key": [item, ...]` one item at a time."""
+    f.write('"{}": ['.format(key))
+    for i, item in enumerate(items):
+        if i:
+            f.write(', ')
+        f.write(json.dumps(item))
+    f.write(']')
+
+
+def _split(blocks, field):
+    """Splits blocks into per-protein sequences or propensities."""
+    for lengths, sequences, propensities in blocks:
+        bounds = np.cumsum(lengths)[:-1]
+        if field == 'X':
+            for sequence in np.split(sequences, bounds):
+                yield sequence.tobytes().decode('ascii')
+        else:
+            for values in np.split(propensities, bounds):
+                yield values.tolist()
+
+
+def _lengths_and_seed(lengths, num_proteins, seed, kwargs):
+    if seed is None:
+        seed = np.random.randint(2 ** 31)
+    if lengths is None:
+        lengths = protein_lengths(num_proteins, seed=[seed, 0], **kwargs)
+    return np.asarray(lengths, dtype=np.int64), seed
+
+
+def make_archive(fpath, num_proteins=1000, lengths=None, coverage=0.7,
+                 seed=None, cache=False, **kwargs):
+    """Writes a random archive in the layout of the dSPP database.
+
+    The archive is a `tar.gz` holding a single JSON document with the
+    sequences `X`, per-residue propensities `Y` and entry IDs `ID`, as
+    read by `dspp.load_data`. The document is written one protein at a
+    time, so archives far larger than the real dataset can be made.
+
+    # Arguments
+        fpath: path of the archive to write.
+        num_proteins: number of proteins.
+        lengths: lengths of the proteins, replacing `num_proteins` and
+            the length distribution.
+        coverage: fraction of residues with an assigned, non-zero
+            propensity.
+        seed: random seed.
+        cache: whether to also write the binary cache of the archive,
+            so that loading it skips the conversion.
+        **kwargs: length distribution, see `protein_lengths`.
+
+    # Returns
+        The path of the archive.
+
+    # Example
+
+    ```python
+        path = make_archive('/tmp/dspp.tar.gz', num_proteins=100000,
+                            distribution='uniform', max_length=2000)
+        X, Y = dspp.load_data(path)
+    ```
+    """
+    lengths, seed = _lengths_and_seed(lengths, num_proteins, seed, kwargs)
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        json_path = os.path.join(tmp_dir, 'database.json')
+        with open(json_path, 'w') as f:
+            f.write('{')
+            for key in ('X', 'Y'):
+                blocks = _blocks(lengths, coverage, [seed, 1])
+                _write_array(f, key, _split(blocks, key))
+                f.write(', ')
+            _write_array(f, 'ID', ('dSPP{}_0'.format(i)
+                                   for i in range(len(lengths))))
+            f.write('}')
+        with tarfile.open(fpath, 'w:gz') as tar:
+            tar.add(json_path, arcname='database.json')
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    if cache:
+        cache_path = dspp._cache_path(fpath, _hash_file(fpath, 'sha256'))
+        make_cache(cache_path, lengths=lengths, coverage=coverage, seed=seed)
+    return fpath
+
+
+def make_cache(cache_path, num_proteins=1000, lengths=None, coverage=0.7,
+               seed=None, **kwargs):
+    """Writes a random dataset straight into the binary cache layout.
+
+    No archive is involved, which makes datasets many times the size of
+    dSPP quick to create. With equal arguments, the proteins are the same
+    as those of `make_archive`.
+
+    # Arguments
+        cache_path: directory to write the cache to.
+        num_proteins: number of proteins.
+        lengths: lengths of the proteins, replacing `num_proteins` and
+            the length distribution.
+        coverage: fraction of residues with an assigned, non-zero
+            propensity.
+        seed: random seed.
+        **kwargs: length distribution, see `protein_lengths`.
+
+    # Returns
+        The path of the cache, to be opened with `dspp.DSPPDataset`.
+    """
+    lengths, seed = _lengths_and_seed(lengths, num_proteins, seed, kwargs)
+    offsets = dspp._offsets(lengths)
+    sequences = np.empty(offsets[-1], dtype=np.uint8)
+    propensities = np.empty(offsets[-1], dtype=np.float32)
+    position = 0
+    for _, block_sequences, block_propensities in _blocks(
+            lengths, coverage, [seed, 1]):
+        end = position + len(block_sequences)
+        sequences[position:end] = block_sequences
+        propensities[position:end] = block_propensities
+        position = end
+
+    dspp._write_cache({
+        'sequences': sequences,
+        'sequence_offsets': offsets,
+        'propensities': propensities,
+        'propensity_offsets': offsets,
+        'stats': dspp._propensity_stats(propensities, offsets),
+        'ids': np.array(['dSPP{}_0'.format(i) for i in range(len(lengths))],
+                        dtype=np.str_)}, cache_path)
+    return cache_path
@@ -0,0 +1,100 @@
+"""Keras layers taking amino acid indices as input.
+
+Feeding models `(N, L)` integer indices, as produced by
+`encode_sequences(..., sparse=True, dtype='int8')`, instead of `(N, L, 20)`
+one-hot vectors shrinks the input pipeline and host to device copies
+twentyfold. The layers below expand the indices inside the model.
+"""
+from __future__ import absolute_import
+
+from keras import backend as K
+from keras.layers import Embedding
+from keras.layers import Input
+from keras.layers import Layer
+
+from .preprocessing.sequence import AMINO_ACIDS
+
+
+class OneHot(Layer):
+    """Expands amino acid indices into one-hot vectors.
+
+    Index 0 marks padding and becomes an all-zero vector, indices 1 to 20
+    are the amino acids in the order of `AMINO_ACIDS`.
+
+    # Arguments
+        num_classes: number of amino acids.
+        mask_zero: whether to propagate padding as a mask, as `Embedding`
+            does. All downstream layers then need to support masking,
+            which `Flatten` for one does not.
+
+    # Input shape
+        Integer tensor of shape `(batch_size, length)`.
+
+    # Output shape
+        Float tensor of shape `(batch_size, length, num_classes)`.
+
+    # Example
+
+    ```python
+        model = Sequential()
+        model.add(OneHot(input_shape=(800,)))
+        model.add(Conv1D(64, 9, padding='same'))
+    ```
+    """
+
+    def __init__(self, num_classes=len(AMINO_ACIDS), mask_zero=False,
+                 **kwargs):
+        super(OneHot, self).__init__(**kwargs)
+        self.num_classes = num_classes
+        self.mask_zero = mask_zero
+        self.supports_masking = mask_zero
+
+    def call(self, inputs):
+        one_hot = K.one_hot(K.cast(inputs, 'int32'), self.num_classes + 1)
+        return one_hot[..., 1:]
+
+    def compute_output_shape(self, input_shape):
+        return tuple(input_shape) + (self.num_classes,)
+
+    def compute_mask(self, inputs, mask=None):
+        if not self.mask_zero:
+            return None
+        return K.not_equal(inputs, 0)
+
+    def get_config(self):
+        config = {'num_classes': self.num_classes,
+                  'mask_zero': self.mask_zero}
+        base_config = super(OneHot, self).get_config()
+        return dict(list(base_config.items()) + list(config.items()))
+
+
+def sequence_input(maxlen=None, embedding_dim=None, name='sequence'):
+    """Creates an input for amino acid indices and expands it.
+
+    # Arguments
+        maxlen: length of the padded sequences, `None` for batches
+            padded to varying lengths.
+        embedding_dim: size of a learned embedding of the amino acids,
+            `None` for one-hot vectors.
+        name: name of the input.
+
+    # Returns
+        Tuple `(inputs, encoded)`: the `int8` input tensor of shape
+        `(batch_size, maxlen)`, and the one-hot or embedded tensor of shape
+        `(batch_size, maxlen, 20)` or `(batch_size, maxlen, embedding_dim)`,
+        with padding masked.
+
+    # Example
+
+    ```python
+        inputs, x = sequence_input(embedding_dim=16)
+        x = LSTM(32, return_sequences=True)(x)
+        model = Model(inputs, TimeDistributed(Dense(1))(x))
+    ```
+    """
+    inputs = Input(shape=(maxlen,), dtype='int8', name=name)
+    if embedding_dim is None:
+        return inputs, OneHot(mask_zero=True)(inputs)
+    embedding = Embedding(len(AMINO_ACIDS) + 1, embedding_dim,
+                          mask_zero=True)
+    return inputs, embedding(inputs)
@@ -0,0 +1,220 @@
+"""Propensity prediction for raw amino acid sequences."""
+from __future__ import absolute_import
+
+import collections
+import hashlib
+import threading
+
+import numpy as np
+import six
+from six.moves import queue
+
+from .preprocessing.sequence import concatenate_sequences
+from .preprocessing.sequence import encode_sequences
+from .preprocessing.sequence import sliding_windows
+from .preprocessing.sequence import stitch_windows
+
+
+class PropensityPredictor(object):
+    """Predicts per-residue propensities of amino acid sequences.
+
+    Sequences are sorted by length and padded one batch at a time, so
+    short sequences are not padded to the length of the longest one. While
+    the calling thread encodes the next batch, a background thread runs
+    the model on the previous one. Predictions are kept in an LRU cache
+    keyed by a hash of the sequence, so repeated queries are free. The
+    cached arrays are returned read-only.
+
+    The model must map `(batch_size, length, 20)` one-hot inputs, or
+    `(batch_size, length)` indices when `sparse`, to one prediction per
+    residue. Models with a fixed input length get every batch padded to
+    that length. Longer sequences are then cut into windows overlapping by
+    `overlap` residues, and their predictions averaged where windows
+    overlap.
+
+    # Arguments
+        model: a Keras model.
+        batch_size: number of sequences per batch.
+        sparse: whether the model takes integer indices instead of one-hot
+            vectors (see `encode_sequences`).
+        dtype: type of the model inputs.
+        padding: 'pre' or 'post', pad before or after each sequence.
+        cache_size: maximum number of cached predictions.
+        overlap: residues shared by consecutive windows of sequences
+            longer than the fixed input length of the model, `None` to
+            reject such sequences.
+
+    # Example
+
+    ```python
+        predictor = PropensityPredictor(model)
+        propensities = predictor.predict(['MGSSHHHHHHSSGLVPRGSH', 'MDVFMK'])
+    ```
+    """
+
+    def __init__(self, model, batch_size=64, sparse=False, dtype='float32',
+                 padding='pre', cache_size=4096, overlap=None):
+        self.model = model
+        self.batch_size = batch_size
+        self.sparse = sparse
+        self.dtype = dtype
+        self.padding = padding
+        self.cache_size = cache_size
+        self.overlap = overlap
+        self.maxlen = model.input_shape[1]
+        self._cache = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(sequence):
+        return hashlib.sha1(sequence.encode('ascii')).digest()
+
+    def _lookup(self, key):
+        with self._lock:
+            value = self._cache.pop(key, None)
+            if value is not None:
+                self._cache[key] = value
+            return value
+
+    def _store(self, key, value):
+        with self._lock:
+            self._cache.pop(key, None)
+            self._cache[key] = value
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+    def clear_cache(self):
+        """Forgets all cached predictions."""
+        with self._lock:
+            self._cache.clear()
+
+    def _run(self, inputs, outputs):
+        """Predicts the batches put in `inputs` until it receives `None`.
+
+        After an error, remaining batches are drained without predicting
+        them so that the producer never blocks.
+        """
+        error = None
+        while True:
+            x = inputs.get()
+            if x is None:
+                return
+            if error is None:
+                try:
+                    outputs.put(np.asarray(self.model.predict_on_batch(x)))
+                except Exception as e:
+                    error = e
+                    outputs.put(e)
+
+    def _unpad(self, prediction, sequences):
+        """Cuts the predictions of a batch back to the sequence lengths."""
+        if prediction.ndim == 3 and prediction.shape[-1] == 1:
+            prediction = prediction[..., 0]
+        length = prediction.shape[1]
+        results = []
+        for row, sequence in zip(prediction, sequences):
+            if self.padding == 'post':
+                results.append(row[:len(sequence)])
+            else:
+                results.append(row[length - len(sequence):])
+        return results
+
+    def _predict_batches(self, sequences):
+        """Predicts sequences that fit the model input, in length order.
+
+        # Returns
+            List of the `float32` predictions of `sequences`.
+        """
+        order = sorted(range(len(sequences)),
+                       key=lambda i: len(sequences[i]))
+        batches = [order[i:i + self.batch_size]
+                   for i in range(0, len(order), self.batch_size)]
+        results = [None] * len(sequences)
+        if not batches:
+            return results
+        inputs, outputs = queue.Queue(maxsize=2), queue.Queue()
+        worker = threading.Thread(target=self._run, args=(inputs, outputs))
+        worker.daemon = True
+        worker.start()
+        try:
+            for batch in batches:
+                inputs.put(encode_sequences(
+                    [sequences[i] for i in batch], maxlen=self.maxlen,
+                    dtype=self.dtype, padding=self.padding,
+                    sparse=self.sparse))
+            for batch in batches:
+                prediction = outputs.get()
+                if isinstance(prediction, Exception):
+                    raise prediction
+                for i, value in zip(batch, self._unpad(
+                        prediction, [sequences[i] for i in batch])):
+                    results[i] = value.astype(np.float32)
+        finally:
+            inputs.put(None)
+            worker.join()
+        return results
+
+    def _predict_windows(self, sequences):
+        """Predicts long sequences from their overlapping windows."""
+        offsets = concatenate_sequences(sequences)[1]
+        windows = sliding_windows(offsets, self.maxlen, self.overlap)
+        # Windows are not worth caching, only the stitched predictions.
+        pieces = self._predict_batches(
+            [sequences[protein][start:start + length]
+             for protein, start, length in zip(*windows)])
+        padded = np.zeros((len(pieces), self.maxlen), dtype=np.float32)
+        for row, piece in zip(padded, pieces):
+            row[:len(piece)] = piece
+        return stitch_windows(padded, offsets, windows, padding='post')
+
+    def predict(self, sequences):
+        """Predicts the propensities of amino acid sequences.
+
+        # Arguments
+            sequences: a sequence as a string, or a list of them.
+
+        # Returns
+            The `float32` propensities of every residue, a list of arrays
+            for a list of sequences. The arrays are read-only, as they
+            are shared with the cache.
+
+        # Raises
+            ValueError: if a sequence is longer than the fixed input
+                length of the model and `overlap` is `None`.
+        """
+        if isinstance(sequences, six.string_types):
+            return self.predict([sequences])[0]
+        sequences = [sequence.upper() for sequence in sequences]
+        keys = [self._key(sequence) for sequence in sequences]
+
+        results, missing = {}, {}
+        for key, sequence in zip(keys, sequences):
+            if key in results or key in missing:
+                continue
+            value = self._lookup(key)
+            if value is None:
+                missing[key] = sequence
+            else:
+                results[key] = value
+        if self.maxlen is not None:
+            long = [(key, sequence) for key, sequence in missing.items()
+                    if len(sequence) > self.maxlen]
+            if long and self.overlap is None:
+                raise ValueError('Sequence of length {} exceeds the model '
+                                 'input length {}'.format(len(long[0][1]),
+                                                          self.maxlen))
+            if long:
+                for key, value in zip([key for key, _ in long],
+                                      self._predict_windows(
+                                          [s for _, s in long])):
+                    results[key] = value
+                    del missing[key]
+
+        for key, value in zip(missing, self._predict_batches(
+                list(missing.values()))):
+            results[key] = value
+        for key, value in results.items():
+            value.setflags(write=False)
+            self._store(key, value)
+
+        return [results[key] for key in keys]
@@ -0,0 +1,8 @@
+from __future__ import absolute_import
+
+from . import clustering
+from . import features
+from . import loader
+from . import sampling
+from . import sequence
+from . import splitting
@@ -0,0 +1,172 @@
+"""Clustering of similar sequences by k-mer MinHash signatures."""
+from __future__ import absolute_import
+
+import multiprocessing
+
+import numpy as np
+
+from .sequence import AMINO_ACIDS
+from .sequence import sequences_to_indices
+
+# Prime modulus of the universal hash functions, above the range of k-mer
+# codes for k <= 7 and small enough for the products to fit in 64 bits.
+_PRIME = np.uint64(4294967311)
+_MAX_K = 7
+
+
+def kmer_codes(indices, offsets, k=3):
+    """Encodes all k-mers of concatenated sequences as integers.
+
+    # Arguments
+        indices: concatenated amino acid indices (see
+            `sequences_to_indices`).
+        offsets: `(N + 1,)` offsets of the sequences into `indices`.
+        k: length of the k-mers.
+
+    # Returns
+        Tuple `(codes, rows)`: the `uint64` code of every k-mer that lies
+        within a single sequence, and the sequence it belongs to. k-mers
+        are ordered by sequence.
+    """
+    if not 1 <= k <= _MAX_K:
+        raise ValueError('k must be between 1 and {}, got {}'.format(
+            _MAX_K, k))
+    n = len(indices) - k + 1
+    if n <= 0:
+        return np.zeros(0, dtype=np.uint64), np.zeros(0, dtype=np.int64)
+    codes = np.zeros(n, dtype=np.uint64)
+    for j in range(k):
+        codes *= np.uint64(len(AMINO_ACIDS))
+        codes += indices[j:j + n]
+    lengths = np.diff(offsets)
+    rows = np.repeat(np.arange(len(lengths)), lengths)[:n]
+    valid = np.arange(n) + k <= offsets[rows + 1]
+    return codes[valid], rows[valid]
+
+
+def _minhash(args):
+    """Minimum of every hash function over the k-mers of every sequence."""
+    codes, starts, a, b = args
+    signatures = np.empty((len(starts), len(a)), dtype=np.uint64)
+    for h in range(len(a)):
+        hashed = (codes * a[h] + b[h]) % _PRIME
+        signatures[:, h] = np.minimum.reduceat(hashed, starts)
+    return signatures
+
+
+def minhash_signatures(sequences, offsets=None, k=3, num_hashes=64, seed=0,
+                       workers=None):
+    """Computes MinHash signatures of the k-mer sets of sequences.
+
+    The fraction of equal entries in the signatures of two sequences
+    estimates the Jaccard similarity of their k-mer sets.
+
+    # Arguments
+        sequences: list of sequences (see `concatenate_sequences`), or a
+            buffer of ASCII codes when `offsets` is given.
+        offsets: `(N + 1,)` offsets of the sequences into the buffer.
+        k: length of the k-mers.
+        num_hashes: number of hash functions.
+        seed: random seed of the hash functions.
+        workers: number of processes sharing the hash functions,
+            `None` to compute in this process.
+
+    # Returns
+        Tuple `(signatures, valid)`: the `(N, num_hashes)` signatures, and
+        whether each sequence has any k-mer. Signatures of sequences
+        shorter than `k` are meaningless.
+    """
+    indices, offsets = sequences_to_indices(sequences, offsets)
+    codes, rows = kmer_codes(indices, offsets, k)
+    counts = np.bincount(rows, minlength=len(offsets) - 1)
+    valid = counts > 0
+    starts = np.zeros(len(counts), dtype=np.int64)
+    np.cumsum(counts[:-1], out=starts[1:])
+
+    random = np.random.RandomState(seed)
+    a = random.randint(1, int(_PRIME), size=num_hashes).astype(np.uint64)
+    b = random.randint(0, int(_PRIME), size=num_hashes).astype(np.uint64)
+    starts = starts[valid]
+    if workers is None or workers < 2:
+        chunks = [_minhash((codes, starts, a, b))]
+    else:
+        splits = np.array_split(np.arange(num_hashes), workers)
+        pool = multiprocessing.Pool(workers)
+        try:
+            chunks = pool.map(_minhash, [(codes, starts, a[s], b[s])
+                                         for s in splits if len(s)])
+        finally:
+            pool.close()
+            pool.join()
+    signatures = np.zeros((len(counts), num_hashes), dtype=np.uint64)
+    signatures[valid] = np.hstack(chunks)
+    return signatures, valid
+
+
+def _find(parents, i):
+    while parents[i] != i:
+        parents[i] = parents[parents[i]]
+        i = parents[i]
+    return i
+
+
+def cluster_sequences(sequences, offsets=None, threshold=0.5, k=3,
+                      num_hashes=64, bands=16, seed=0, workers=None):
+    """Clusters sequences with similar k-mer content.
+
+    Candidate pairs are found by locality sensitive hashing of MinHash
+    signatures: sequences whose signatures agree on all rows of any of
+    `bands` bands are compared, and linked when their estimated Jaccard
+    similarity reaches `threshold`. Clusters are the connected
+    components of these links, so no all-against-all comparison is made.
+
+    # Arguments
+        sequences: list of sequences (see `concatenate_sequences`), or a
+            buffer of ASCII codes when `offsets` is given.
+        offsets: `(N + 1,)` offsets of the sequences into the buffer.
+        threshold: minimum estimated Jaccard similarity of the k-mer sets
+            of linked sequences.
+        k: length of the k-mers.
+        num_hashes: number of hash functions, a multiple of `bands`.
+        bands: number of bands, more bands find less similar pairs.
+        seed: random seed of the hash functions.
+        workers: number of processes computing the signatures.
+
+    # Returns
+        `(N,)` array of cluster labels, numbered from 0 in order of the
+        first member of each cluster.
+
+    # Example
+
+    ```python
+        dataset = dspp.load_dataset()
+        clusters = cluster_sequences(dataset.sequences,
+                                     dataset.sequence_offsets)
+        train, test = train_test_split(len(dataset), groups=clusters)
+    ```
+    """
+    if num_hashes % bands:
+        raise ValueError('num_hashes ({}) must be a multiple of bands '
+                         '({})'.format(num_hashes, bands))
+    signatures, valid = minhash_signatures(sequences, offsets, k=k,
+                                           num_hashes=num_hashes, seed=seed,
+                                           workers=workers)
+    candidates = np.flatnonzero(valid)
+    rows = num_hashes // bands
+    parents = np.arange(len(signatures))
+    for band in range(bands):
+        keys = signatures[candidates, band * rows:(band + 1) * rows]
+        order = candidates[np.lexsort(keys.T[::-1])]
+        sorted_keys = signatures[order, band * rows:(band + 1) * rows]
+        same = np.all(sorted_keys[1:] == sorted_keys[:-1], axis=1)
+        first, second = order[:-1][same], order[1:][same]
+        similarity = np.mean(signatures[first] == signatures[second], axis=1)
+        for i, j in zip(first[similarity >= threshold],
+                        second[similarity >= threshold]):
+            root_i, root_j = _find(parents, i), _find(parents, j)
+            if root_i != root_j:
+                parents[max(root_i, root_j)] = min(root_i, root_j)
+
+    roots = np.array([_find(parents, i) for i in range(len(parents))],
+                     dtype=np.int64)
+    return np.unique(roots, return_inverse=True)[1].ravel()
@@ -0,0 +1,195 @@
+"""Per-residue physicochemical features and their on-disk store."""
+from __future__ import absolute_import
+
+import hashlib
+import json
+import os
+import tempfile
+
+import numpy as np
+import six
+
+from .sequence import AMINO_ACIDS
+from .sequence import sequences_to_indices
+from ..utils.data_utils import FileLock
+from ..utils.data_utils import get_cache_dir
+from ..utils.data_utils import _replace_file
+
+# Bump whenever the computation of a feature changes.
+_FEATURE_VERSION = 1
+
+# Per amino acid scales, in the order of `AMINO_ACIDS`.
+SCALES = {
+    # Kyte & Doolittle hydropathy index.
+    'hydrophobicity': [1.8, 2.5, -3.5, -3.5, 2.8, -0.4, -3.2, 4.5, -3.9, 3.8,
+                       1.9, -3.5, -1.6, -3.5, -4.5, -0.8, -0.7, 4.2, -0.9,
+                       -1.3],
+    # Side chain charge at neutral pH.
+    'charge': [0., 0., -1., -1., 0., 0., 0.1, 0., 1., 0.,
+               0., 0., 0., 0., 1., 0., 0., 0., 0., 0.],
+    # Residue volume in cubic angstroms, after Zamyatnin.
+    'volume': [88.6, 108.5, 111.1, 138.4, 189.9, 60.1, 153.2, 166.7, 168.6,
+               166.7, 162.9, 114.1, 112.7, 143.8, 173.4, 89.0, 116.1, 140.0,
+               227.8, 193.6],
+}
+
+
+def _normalize(features):
+    """Turns feature names or `(name, window)` tuples into tuples."""
+    normalized = []
+    for feature in features:
+        if isinstance(feature, six.string_types):
+            feature = (feature, 1)
+        name, window = feature
+        if name not in SCALES and name != 'composition':
+            raise ValueError('Unknown feature: ' + str(name))
+        if window < 1 or window % 2 == 0:
+            raise ValueError('Feature windows must be odd, got {} for '
+                             '{}'.format(window, name))
+        normalized.append((name, int(window)))
+    return normalized
+
+
+def _window_mean(values, offsets, window):
+    """Averages per-residue values over a window centered on each residue.
+
+    Windows are clipped at the ends of each sequence.
+
+    # Arguments
+        values: `(residues, ...)` concatenated values.
+        offsets: `(N + 1,)` offsets of the sequences into `values`.
+        window: odd width of the window.
+
+    # Returns
+        Array of the same shape as `values`.
+    """
+    if window == 1:
+        return values
+    sums = np.zeros((len(values) + 1,) + values.shape[1:], dtype=np.float64)
+    np.cumsum(values, axis=0, out=sums[1:])
+    lengths = np.diff(offsets)
+    starts = np.repeat(offsets[:-1], lengths)
+    ends = np.repeat(offsets[1:], lengths)
+    positions = np.arange(len(values))
+    low = np.maximum(positions - window // 2, starts)
+    high = np.minimum(positions + window // 2 + 1, ends)
+    counts = (high - low).reshape((-1,) + (1,) * (values.ndim - 1))
+    return (sums[high] - sums[low]) / counts
+
+
+def feature_width(features):
+    """Number of columns produced by `features`."""
+    return sum(len(AMINO_ACIDS) if name == 'composition' else 1
+               for name, _ in _normalize(features))
+
+
+def compute_features(sequences, offsets=None, features=('hydrophobicity',),
+                     dtype='float32'):
+    """Computes per-residue features over concatenated sequences.
+
+    # Arguments
+        sequences: list of sequences (see `concatenate_sequences`), or a
+            buffer of ASCII codes when `offsets` is given.
+        offsets: `(N + 1,)` offsets of the sequences into the buffer.
+        features: list of feature names, or `(name, window)` tuples for
+            averages over a window centered on each residue. Names are the
+            keys of `SCALES`, or 'composition' for the fraction of every
+            amino acid, 20 columns.
+        dtype: type of the features.
+
+    # Returns
+        Array of shape `(residues, feature_width(features))`, aligned with
+        the concatenated sequences.
+    """
+    indices, offsets = sequences_to_indices(sequences, offsets)
+    columns = []
+    for name, window in _normalize(features):
+        if name == 'composition':
+            values = np.eye(len(AMINO_ACIDS), dtype=np.float32)[indices]
+        else:
+            scale = np.asarray(SCALES[name], dtype=np.float32)
+            values = scale[indices][:, None]
+        columns.append(_window_mean(values, offsets, window))
+    if not columns:
+        return np.zeros((len(indices), 0), dtype=dtype)
+    return np.hstack(columns).astype(dtype)
+
+
+class FeatureStore(object):
+    """Computes feature sets once and keeps them as memory-mapped arrays.
+
+    Feature arrays are stored under a key made of a digest of the
+    sequences and a digest of the feature specification, so changing
+    either computes a new array while unchanged ones are reused.
+
+    # Arguments
+        cache_subdir: Subdirectory under the Keras cache dir holding the
+            features.
+        cache_dir: Location of the cache, see `get_file`.
+        dtype: type of the stored features, 'float16' halves the size.
+
+    # Example
+
+    ```python
+        dataset = dspp.load_dataset()
+        store = FeatureStore()
+        features = store.get(dataset, ['hydrophobicity', ('charge', 9)])
+        generator = PaddedBatchGenerator(dataset, features=features)
+    ```
+    """
+
+    def __init__(self, cache_subdir='dspp-features', cache_dir=None,
+                 dtype='float16'):
+        self.path = get_cache_dir(cache_subdir, cache_dir)
+        self.dtype = np.dtype(dtype)
+
+    def key(self, sequences, offsets, features):
+        """Name of the file storing `features` of the given sequences."""
+        data = hashlib.sha256()
+        data.update(np.ascontiguousarray(sequences).tobytes())
+        data.update(np.ascontiguousarray(offsets, dtype=np.int64).tobytes())
+        spec = json.dumps({'features': _normalize(features),
+                           'scales': SCALES,
+                           'dtype': self.dtype.name,
+                           'version': _FEATURE_VERSION}, sort_keys=True)
+        spec = hashlib.sha256(spec.encode('utf-8'))
+        return '{}-{}.npy'.format(data.hexdigest()[:16],
+                                  spec.hexdigest()[:16])
+
+    def get(self, sequences, features, offsets=None):
+        """Returns the features of the sequences, computing them if needed.
+
+        # Arguments
+            sequences: a `DSPPDataset`, or a buffer of ASCII codes with
+                its `offsets`.
+            features: feature specification, see `compute_features`.
+            offsets: `(N + 1,)` offsets of the sequences into the buffer.
+
+        # Returns
+            Memory-mapped array of shape `(residues, feature_width(
+            features))` aligned with the whole buffer of sequences, also
+            for a subset of a `DSPPDataset`.
+        """
+        if hasattr(sequences, 'sequence_offsets'):
+            sequences, offsets = (sequences.sequences,
+                                  sequences.sequence_offsets)
+        fpath = os.path.join(self.path,
+                             self.key(sequences, offsets, features))
+        if not os.path.exists(fpath):
+            with FileLock(fpath + '.lock'):
+                if not os.path.exists(fpath):
+                    self._compute(sequences, offsets, features, fpath)
+        return np.load(fpath, mmap_mode='r')
+
+    def _compute(self, sequences, offsets, features, fpath):
+        values = compute_features(sequences, offsets, features,
+                                  dtype=self.dtype)
+        fd, tmp_path = tempfile.mkstemp(dir=self.path, suffix='.npy')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                np.save(f, values)
+            _replace_file(tmp_path, fpath)
+        except (IOError, OSError):
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
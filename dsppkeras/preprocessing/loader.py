@@ -0,0 +1,209 @@
+"""Encoding batches in worker processes, handed over in shared memory."""
+from __future__ import absolute_import
+
+import multiprocessing
+import traceback
+
+import numpy as np
+from six.moves import queue
+
+from ..utils import instrumentation
+
+try:
+    from multiprocessing import shared_memory
+except ImportError:
+    shared_memory = None
+
+# Alignment of the arrays within a shared memory slot, in bytes.
+_ALIGNMENT = 64
+
+
+def _flatten(batch):
+    """Turns `(x, y, weights)` with `x` possibly a list into arrays."""
+    x, y, weights = batch
+    if isinstance(x, list):
+        return list(x) + [y, weights], len(x)
+    return [x, y, weights], None
+
+
+def _unflatten(arrays, inputs):
+    if inputs is None:
+        return tuple(arrays)
+    return list(arrays[:inputs]), arrays[inputs], arrays[inputs + 1]
+
+
+def _worker(generator, tasks, results, slot_names, slot_bytes):
+    """Encodes the batches of `tasks` into the shared memory slots.
+
+    Every task is `(slot, indices)`. The batch of proteins at `indices`
+    is written into the slot and only the layout of its arrays is sent
+    back. Batches which do not fit the slot are sent back as a whole.
+    """
+    slots = [shared_memory.SharedMemory(name=name) for name in slot_names]
+    try:
+        while True:
+            task = tasks.get()
+            if task is None:
+                return
+            slot, indices = task
+            try:
+                arrays, inputs = _flatten(generator.encode(indices))
+                layout, offset = [], 0
+                for array in arrays:
+                    offset = -(-offset // _ALIGNMENT) * _ALIGNMENT
+                    layout.append((offset, array.dtype.str, array.shape))
+                    offset += array.nbytes
+                if offset > slot_bytes:
+                    results.put((slot, 'arrays', (arrays, inputs)))
+                    continue
+                for (start, dtype, shape), array in zip(layout, arrays):
+                    view = np.ndarray(shape, dtype=dtype,
+                                      buffer=slots[slot].buf, offset=start)
+                    view[...] = array
+                results.put((slot, 'layout', (layout, inputs)))
+            except Exception:
+                results.put((slot, 'error', traceback.format_exc()))
+    finally:
+        for memory in slots:
+            memory.close()
+
+
+class SharedMemoryLoader(object):
+    """Encodes and pads batches of a generator in a pool of processes.
+
+    Worker processes call `encode` of a `PaddedBatchGenerator` and write
+    the batches into a ring of `multiprocessing.shared_memory` slots;
+    only the offsets, types and shapes of the arrays go back through a
+    queue, so batches are never pickled. Up to `prefetch` batches are
+    encoded ahead of the consumer.
+
+    The loader is an endless iterator over the batches of consecutive
+    epochs, calling `on_epoch_end` of the generator in between, for use
+    with `fit_generator` and `steps_per_epoch=len(loader)`. Like those of
+    the generator, the batches need a model compiled with
+    `sample_weight_mode='temporal'`.
+
+    # Arguments
+        generator: a `PaddedBatchGenerator`.
+        workers: number of worker processes.
+        prefetch: number of batches encoded ahead, and of shared memory
+            slots.
+        slot_bytes: size of every slot. Larger batches are passed
+            through the queue instead.
+        copy: whether to copy batches out of the shared memory. Without
+            copying, a batch is only valid until the next one is drawn.
+
+    # Example
+
+    ```python
+        generator = PaddedBatchGenerator(dspp.load_dataset())
+        with SharedMemoryLoader(generator, workers=4) as loader:
+            model.fit_generator(loader, steps_per_epoch=len(loader))
+    ```
+    """
+
+    def __init__(self, generator, workers=4, prefetch=8, slot_bytes=1 << 25,
+                 copy=True):
+        if shared_memory is None:
+            raise ImportError('`SharedMemoryLoader` requires '
+                              '`multiprocessing.shared_memory` (Python 3.8+).')
+        if prefetch < 1:
+            raise ValueError('prefetch must be at least 1')
+        self.generator = generator
+        self.slot_bytes = slot_bytes
+        self.copy = copy
+        self.slots = [shared_memory.SharedMemory(create=True, size=slot_bytes)
+                      for _ in range(prefetch)]
+        self.tasks = multiprocessing.Queue()
+        self.results = multiprocessing.Queue()
+        self.workers = []
+        for _ in range(workers):
+            process = multiprocessing.Process(
+                target=_worker,
+                args=(generator, self.tasks, self.results,
+                      [slot.name for slot in self.slots], slot_bytes))
+            process.daemon = True
+            process.start()
+            self.workers.append(process)
+
+        self._free = list(range(prefetch))
+        self._scheduled = []
+        self._ready = {}
+        self._held = None
+        self._next_batch = 0
+
+    def __len__(self):
+        return len(self.generator)
+
+    def __iter__(self):
+        return self
+
+    def _schedule(self):
+        """Hands out batches to the workers while slots are free."""
+        while self._free:
+            if self._next_batch == len(self.generator.batches):
+                if self._scheduled:
+                    return
+                self.generator.on_epoch_end()
+                self._next_batch = 0
+            slot = self._free.pop()
+            self.tasks.put((slot, self.generator.batches[self._next_batch]))
+            self._scheduled.append(slot)
+            self._next_batch += 1
+
+    def __next__(self):
+        if self._held is not None:
+            self._free.append(self._held)
+            self._held = None
+        self._schedule()
+        slot = self._scheduled.pop(0)
+        with instrumentation.timer('loader.wait'):
+            while slot not in self._ready:
+                try:
+                    done, kind, payload = self.results.get(timeout=1)
+                except queue.Empty:
+                    if not all(process.is_alive()
+                               for process in self.workers):
+                        raise RuntimeError('A loader worker process died.')
+                    continue
+                self._ready[done] = (kind, payload)
+        kind, payload = self._ready.pop(slot)
+
+        if kind == 'error':
+            self._free.append(slot)
+            raise RuntimeError('Error in loader worker:\n' + payload)
+        if kind == 'arrays':
+            self._free.append(slot)
+            return _unflatten(*payload)
+        layout, inputs = payload
+        arrays = [np.ndarray(shape, dtype=dtype, buffer=self.slots[slot].buf,
+                             offset=offset)
+                  for offset, dtype, shape in layout]
+        if self.copy:
+            arrays = [array.copy() for array in arrays]
+            self._free.append(slot)
+        else:
+            self._held = slot
+        return _unflatten(arrays, inputs)
+
+    next = __next__
+
+    def close(self):
+        """Stops the workers and releases the shared memory."""
+        for _ in self.workers:
+            self.tasks.put(None)
+        for process in self.workers:
+            process.join(timeout=5)
+            if process.is_alive():
+                process.terminate()
+        self.workers = []
+        for slot in self.slots:
+            slot.close()
+            slot.unlink()
+        self.slots = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
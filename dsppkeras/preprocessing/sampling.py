@@ -0,0 +1,96 @@
+"""Samplers grouping proteins of similar length into batches."""
+from __future__ import absolute_import
+
+import numpy as np
+
+
+class BucketSampler(object):
+    """Groups proteins into length buckets and draws batches from each.
+
+    Every batch only holds proteins of one bucket, so padding a batch to
+    its longest member wastes at most the width of the bucket. Batches
+    either hold a fixed number of proteins, or as many as fit a budget of
+    padded residues, so that short proteins come in large batches and
+    long ones in small batches.
+
+    Shuffling is deterministic: the batches of an epoch only depend on
+    `seed` and the epoch number.
+
+    # Arguments
+        lengths: `(N,)` lengths of the proteins.
+        boundaries: increasing bucket boundaries, a protein of length `l`
+            goes to the first bucket with `l < boundary`. Defaults to the
+            deciles of `lengths`.
+        batch_size: number of proteins per batch.
+        max_tokens: maximum number of padded residues per batch, used
+            instead of `batch_size`.
+        maxlen: maximum length, longer proteins count as `maxlen`.
+        shuffle: whether to shuffle within buckets and the batch order.
+        seed: random seed for shuffling.
+
+    # Example
+
+    ```python
+        sampler = BucketSampler(dataset.lengths, max_tokens=32768, seed=1)
+        generator = PaddedBatchGenerator(dataset, sampler=sampler)
+    ```
+    """
+
+    def __init__(self, lengths, boundaries=None, batch_size=None,
+                 max_tokens=None, maxlen=None, shuffle=True, seed=None):
+        if (batch_size is None) == (max_tokens is None):
+            raise ValueError('Specify exactly one of `batch_size` '
+                             'and `max_tokens`.')
+        lengths = np.asarray(lengths, dtype=np.int64)
+        if maxlen is not None:
+            lengths = np.minimum(lengths, maxlen)
+        if boundaries is None:
+            boundaries = np.unique(np.percentile(lengths,
+                                                 np.arange(10, 100, 10)))
+        boundaries = np.asarray(boundaries)
+        if np.any(np.diff(boundaries) <= 0):
+            raise ValueError('Bucket boundaries must be increasing.')
+        self.lengths = lengths
+        self.boundaries = boundaries
+        self.batch_size = batch_size
+        self.max_tokens = max_tokens
+        self.shuffle = shuffle
+        self.seed = np.random.randint(2 ** 31) if seed is None else seed
+
+        buckets = np.searchsorted(boundaries, lengths, side='right')
+        order = np.argsort(buckets, kind='mergesort')
+        splits = np.searchsorted(buckets[order],
+                                 np.arange(1, len(boundaries) + 1))
+        self.buckets = [bucket for bucket in np.split(order, splits)
+                        if len(bucket)]
+
+    def _bucket_batch_size(self, bucket):
+        if self.max_tokens is None:
+            return self.batch_size
+        return max(1, self.max_tokens // max(1, self.lengths[bucket].max()))
+
+    def sample(self, epoch=0):
+        """Draws the batches of one epoch.
+
+        # Arguments
+            epoch: epoch number, seeding the shuffling.
+
+        # Returns
+            List of arrays with the positions of the proteins of
+            every batch.
+        """
+        random = np.random.RandomState([self.seed, epoch])
+        batches = []
+        for bucket in self.buckets:
+            if self.shuffle:
+                bucket = random.permutation(bucket)
+            size = self._bucket_batch_size(bucket)
+            batches.extend(bucket[i:i + size]
+                           for i in range(0, len(bucket), size))
+        if self.shuffle:
+            batches = [batches[i] for i in random.permutation(len(batches))]
+        return batches
+
+    def __len__(self):
+        return sum(-(-len(bucket) // self._bucket_batch_size(bucket))
+                   for bucket in self.buckets)
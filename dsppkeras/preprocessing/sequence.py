@@ -0,0 +1,518 @@
+"""Utilities for encoding and padding amino acid sequences."""
+from __future__ import absolute_import
+
+import numpy as np
+import six
+
+from ..utils import instrumentation
+
+try:
+    from keras.utils import Sequence
+except ImportError:
+    Sequence = object
+
+# One letter codes of the 20 standard amino acids, in one-hot order.
+AMINO_ACIDS = 'ACDEFGHIKLMNPQRSTVWY'
+
+_UNKNOWN = 255
+_LOOKUP = np.full(256, _UNKNOWN, dtype=np.uint8)
+for _i, _letter in enumerate(AMINO_ACIDS):
+    _LOOKUP[ord(_letter)] = _i
+    _LOOKUP[ord(_letter.lower())] = _i
+
+
+def concatenate_sequences(sequences):
+    """Concatenates sequences into a single buffer of ASCII letter codes.
+
+    # Arguments
+        sequences: list of sequences, each a string, an array of one
+            letter codes (as returned by `dspp.load_data`) or an array
+            of `uint8` ASCII codes.
+
+    # Returns
+        Tuple `(buffer, offsets)`: the `uint8` buffer and the `(N + 1,)`
+        offsets of every sequence into it.
+    """
+    lengths = np.fromiter((len(s) for s in sequences), dtype=np.int64,
+                          count=len(sequences))
+    offsets = np.zeros(len(sequences) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=offsets[1:])
+    if not len(sequences):
+        return np.zeros(0, dtype=np.uint8), offsets
+    if isinstance(sequences[0], six.string_types):
+        buffer = ''.join(sequences).encode('ascii')
+        return np.frombuffer(buffer, dtype=np.uint8), offsets
+    buffer = np.concatenate([np.asarray(s) for s in sequences])
+    if buffer.dtype.kind == 'U':
+        buffer = buffer.astype('S1')
+    return buffer.view(np.uint8), offsets
+
+
+def gather_sequences(buffer, offsets, indices):
+    """Gathers a subset of concatenated sequences into a new buffer.
+
+    # Arguments
+        buffer: concatenated sequences, or any per-residue values.
+        offsets: `(N + 1,)` offsets of the sequences into `buffer`.
+        indices: positions of the sequences to gather.
+
+    # Returns
+        Tuple `(buffer, offsets)` holding only the gathered sequences,
+        in the order of `indices`.
+    """
+    indices = np.asarray(indices, dtype=np.int64)
+    starts = offsets[indices]
+    lengths = offsets[indices + 1] - starts
+    new_offsets = np.zeros(len(indices) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=new_offsets[1:])
+    positions = (np.arange(new_offsets[-1]) +
+                 np.repeat(starts - new_offsets[:-1], lengths))
+    return buffer[positions], new_offsets
+
+
+def sequences_to_indices(sequences, offsets=None):
+    """Maps amino acid letters to their positions in `AMINO_ACIDS`.
+
+    # Arguments
+        sequences: list of sequences (see `concatenate_sequences`), or a
+            buffer of ASCII codes when `offsets` is given.
+        offsets: `(N + 1,)` offsets of the sequences into the buffer.
+
+    # Returns
+        Tuple `(indices, offsets)`: the concatenated `uint8` indices
+        and the offsets of every sequence into them.
+
+    # Raises
+        ValueError: in case of letters other than the 20 amino acids.
+    """
+    if offsets is None:
+        sequences, offsets = concatenate_sequences(sequences)
+    indices = _LOOKUP[np.asarray(sequences, dtype=np.uint8)]
+    if indices.size and indices.max() == _UNKNOWN:
+        letter = chr(np.asarray(sequences)[indices == _UNKNOWN][0])
+        raise ValueError('Unknown amino acid one letter code: ' + letter)
+    return indices, offsets
+
+
+def _padding_layout(offsets, maxlen, padding='pre', truncating='pre'):
+    """Computes where every kept residue goes in a padded array.
+
+    # Arguments
+        offsets: `(N + 1,)` offsets of the sequences into their buffer.
+        maxlen: length of the padded sequences.
+        padding: 'pre' or 'post', pad before or after each sequence.
+        truncating: 'pre' or 'post', remove residues from sequences
+            longer than `maxlen` either in the beginning or in the end.
+
+    # Returns
+        Tuple `(rows, positions, columns)` of flat index arrays: the
+        sequence of every kept residue, its position in the buffer and
+        its position in the padded row.
+    """
+    if padding not in ('pre', 'post'):
+        raise ValueError('Padding type "{}" not understood'.format(padding))
+    if truncating not in ('pre', 'post'):
+        raise ValueError('Truncating type "{}" not '
+                         'understood'.format(truncating))
+    lengths = np.diff(offsets)
+    kept = np.minimum(lengths, maxlen)
+    starts = np.zeros(len(kept), dtype=np.int64)
+    np.cumsum(kept[:-1], out=starts[1:])
+    rows = np.repeat(np.arange(len(kept)), kept)
+    within = np.arange(kept.sum()) - np.repeat(starts, kept)
+    first = offsets[:-1]
+    if truncating == 'pre':
+        first = first + lengths - kept
+    positions = within + np.repeat(first, kept)
+    columns = within
+    if padding == 'pre':
+        columns = within + np.repeat(maxlen - kept, kept)
+    return rows, positions, columns
+
+
+def _maxlen(offsets, maxlen):
+    """Length of the longest sequence, capped at `maxlen`."""
+    longest = int(np.diff(offsets).max()) if len(offsets) > 1 else 0
+    if maxlen is None:
+        return longest
+    return min(longest, maxlen)
+
+
+def encode_sequences(sequences, offsets=None, maxlen=None, dtype='float32',
+                     padding='pre', truncating='pre', sparse=False):
+    """One-hot encodes amino acid sequences into a padded array.
+
+    The whole corpus is translated at once through a lookup table and
+    scattered into a preallocated array, following the padding and
+    truncation conventions of `keras.preprocessing.sequence.pad_sequences`.
+
+    # Arguments
+        sequences: list of sequences (see `concatenate_sequences`), or a
+            buffer of ASCII codes when `offsets` is given.
+        offsets: `(N + 1,)` offsets of the sequences into the buffer.
+        maxlen: length of the padded sequences, defaults to the longest.
+        dtype: type of the output array.
+        padding: 'pre' or 'post', pad before or after each sequence.
+        truncating: 'pre' or 'post', remove residues from sequences
+            longer than `maxlen` either in the beginning or in the end.
+        sparse: whether to return integer indices instead of one-hot
+            vectors. Amino acids are numbered from 1 in the order of
+            `AMINO_ACIDS`, 0 marks padding.
+
+    # Returns
+        Array of shape `(N, maxlen, 20)`, or `(N, maxlen)` when `sparse`.
+
+    # Example
+
+    ```python
+        X, Y = dspp.load_data()
+        X = encode_sequences(X, maxlen=800).reshape(len(X), -1)
+    ```
+    """
+    with instrumentation.timer('encode') as stage:
+        indices, offsets = sequences_to_indices(sequences, offsets)
+        stage.update(proteins=len(offsets) - 1, residues=len(indices))
+    if maxlen is None:
+        maxlen = _maxlen(offsets, maxlen)
+    with instrumentation.timer('pad', proteins=len(offsets) - 1,
+                               maxlen=maxlen):
+        layout = _padding_layout(offsets, maxlen, padding, truncating)
+        return _scatter_indices(indices, layout,
+                                (len(offsets) - 1, maxlen), dtype, sparse)
+
+
+def _scatter_indices(indices, layout, shape, dtype, sparse):
+    """Writes amino acid indices into a padded array following `layout`."""
+    rows, positions, columns = layout
+    tokens = indices[positions]
+    if sparse:
+        x = np.zeros(shape, dtype=dtype)
+        x[rows, columns] = tokens + 1
+    else:
+        x = np.zeros(shape + (len(AMINO_ACIDS),), dtype=dtype)
+        x[rows, columns, tokens] = 1
+    return x
+
+
+def _concatenate_values(values):
+    """Concatenates per-residue values into one `float32` buffer."""
+    offsets = np.zeros(len(values) + 1, dtype=np.int64)
+    np.cumsum([len(v) for v in values], out=offsets[1:])
+    if not len(values):
+        return np.zeros(0, dtype=np.float32), offsets
+    return np.concatenate(values).astype(np.float32, copy=False), offsets
+
+
+def encode_proteins(sequences, propensities, offsets=None, maxlen=None,
+                    dtype='float32', padding='pre', truncating='pre',
+                    sparse=False, features=None):
+    """Encodes sequences, propensities and weights into padded arrays.
+
+    Inputs, targets and the weight mask are produced together, from a
+    single padding layout computed over the concatenated proteins.
+
+    # Arguments
+        sequences: list of sequences (see `concatenate_sequences`), or a
+            buffer of ASCII codes when `offsets` is given.
+        propensities: list of per-residue propensities, or a buffer of
+            propensities when `offsets` is given.
+        offsets: `(N + 1,)` offsets of the proteins into both buffers.
+        maxlen: length of the padded sequences, defaults to the longest.
+        dtype: type of the encoded sequences.
+        padding: 'pre' or 'post', pad before or after each sequence.
+        truncating: 'pre' or 'post', remove residues from sequences
+            longer than `maxlen` either in the beginning or in the end.
+        sparse: whether to encode sequences as integer indices instead
+            of one-hot vectors (see `encode_sequences`).
+        features: `(residues, F)` per-residue features aligned with the
+            concatenated sequences, e.g. from `features.FeatureStore`.
+
+    # Returns
+        Tuple `(x, y, weights)`: the encoded sequences of shape `(N,
+        maxlen, 20)`, or `(N, maxlen)` when `sparse`, and the `float32`
+        propensities and weights of shape `(N, maxlen)`. Weights are 1 for
+        residues with a known, non-zero propensity and 0 elsewhere,
+        including padding. With `features`, `x` is a list of the encoded
+        sequences and the padded features of shape `(N, maxlen, F)`.
+
+    # Raises
+        ValueError: if sequences and propensities differ in length.
+    """
+    with instrumentation.timer('encode') as stage:
+        if offsets is not None:
+            values = propensities
+            indices, offsets = sequences_to_indices(sequences, offsets)
+        else:
+            indices, offsets = sequences_to_indices(sequences)
+            values, value_offsets = _concatenate_values(propensities)
+            if not np.array_equal(offsets, value_offsets):
+                raise ValueError('Every sequence needs exactly one '
+                                 'propensity per residue.')
+        stage.update(proteins=len(offsets) - 1, residues=len(indices))
+    if maxlen is None:
+        maxlen = _maxlen(offsets, maxlen)
+    shape = (len(offsets) - 1, maxlen)
+
+    with instrumentation.timer('pad', proteins=shape[0], maxlen=maxlen):
+        layout = _padding_layout(offsets, maxlen, padding, truncating)
+        x = _scatter_indices(indices, layout, shape, dtype, sparse)
+        rows, positions, columns = layout
+        kept = values[positions]
+        y = np.zeros(shape, dtype=np.float32)
+        y[rows, columns] = kept
+        weights = np.zeros(shape, dtype=np.float32)
+        weights[rows, columns] = kept != 0
+        if features is not None:
+            padded = np.zeros(shape + features.shape[1:],
+                              dtype=features.dtype)
+            padded[rows, columns] = features[positions]
+            x = [x, padded]
+    return x, y, weights
+
+
+def sliding_windows(offsets, size, overlap=0):
+    """Cuts sequences into fixed-size, overlapping windows.
+
+    Consecutive windows of a sequence start `size - overlap` residues
+    apart and the last one ends with the sequence, so every residue is
+    covered without truncation. Sequences up to `size` residues long are
+    a single window.
+
+    # Arguments
+        offsets: `(N + 1,)` offsets of the sequences into their buffer.
+        size: number of residues per window.
+        overlap: minimum number of residues shared by consecutive
+            windows.
+
+    # Returns
+        Tuple `(proteins, starts, lengths)`: for every window the
+        sequence it belongs to, its first residue within that sequence
+        and its number of residues.
+
+    # Raises
+        ValueError: if `overlap` is not smaller than `size`.
+    """
+    if not 0 <= overlap < size:
+        raise ValueError('overlap must be between 0 and size - 1, got '
+                         '{}'.format(overlap))
+    stride = size - overlap
+    lengths = np.diff(offsets)
+    counts = 1 + -(-np.maximum(lengths - size, 0) // stride)
+    proteins = np.repeat(np.arange(len(lengths)), counts)
+    first = np.zeros(len(counts), dtype=np.int64)
+    np.cumsum(counts[:-1], out=first[1:])
+    starts = (np.arange(counts.sum()) - np.repeat(first, counts)) * stride
+    starts = np.minimum(starts, np.maximum(lengths[proteins] - size, 0))
+    return proteins, starts, np.minimum(lengths[proteins], size)
+
+
+def gather_windows(buffer, offsets, windows):
+    """Gathers the residues of windows into a new buffer.
+
+    # Arguments
+        buffer: concatenated sequences, or any per-residue values.
+        offsets: `(N + 1,)` offsets of the sequences into `buffer`.
+        windows: windows as returned by `sliding_windows`.
+
+    # Returns
+        Tuple `(buffer, offsets)` of the windows, which can be encoded
+        like any other sequences.
+
+    # Example
+
+    ```python
+        dataset = dspp.load_dataset()
+        offsets = dataset.sequence_offsets
+        windows = sliding_windows(offsets, size=256, overlap=64)
+        x, window_offsets = gather_windows(dataset.sequences, offsets,
+                                           windows)
+        y, _ = gather_windows(dataset.propensities, offsets, windows)
+        x, y, weights = encode_proteins(x, y, window_offsets, maxlen=256)
+    ```
+    """
+    proteins, starts, lengths = windows
+    new_offsets = np.zeros(len(lengths) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=new_offsets[1:])
+    positions = (np.arange(new_offsets[-1]) +
+                 np.repeat(offsets[proteins] + starts - new_offsets[:-1],
+                           lengths))
+    return buffer[positions], new_offsets
+
+
+def stitch_windows(predictions, offsets, windows, padding='pre'):
+    """Stitches per-window predictions back into whole sequences.
+
+    Residues covered by several windows get the mean of their
+    predictions.
+
+    # Arguments
+        predictions: `(windows, size)` padded per-residue predictions.
+        offsets: `(N + 1,)` offsets of the windowed sequences.
+        windows: windows as returned by `sliding_windows`.
+        padding: 'pre' or 'post', the padding of the predictions.
+
+    # Returns
+        List of `float32` arrays, the predictions for every sequence.
+    """
+    proteins, starts, lengths = windows
+    predictions = np.asarray(predictions)
+    if predictions.ndim == 3 and predictions.shape[-1] == 1:
+        predictions = predictions[..., 0]
+    window_offsets = np.zeros(len(lengths) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=window_offsets[1:])
+    layout = _padding_layout(window_offsets, predictions.shape[1], padding)
+    rows, positions, columns = layout
+    targets = (positions - window_offsets[rows] + starts[rows] +
+               offsets[proteins[rows]])
+    total = int(offsets[-1])
+    sums = np.bincount(targets, weights=predictions[rows, columns],
+                       minlength=total)
+    counts = np.bincount(targets, minlength=total)
+    values = (sums / np.maximum(counts, 1)).astype(np.float32)
+    return np.split(values, offsets[1:-1])
+
+
+class PaddedBatchGenerator(Sequence):
+    """Generates batches of encoded proteins, padded one batch at a time.
+
+    Proteins are encoded only when their batch is requested, and every
+    batch is padded to its own longest member. With `bucketing`, batches
+    are formed from proteins of similar length so that little padding is
+    needed at all.
+
+    # Arguments
+        sequences: list of sequences (see `concatenate_sequences`), or a
+            `DSPPDataset`, in which case `propensities` is ignored.
+        propensities: list of per-residue propensities.
+        batch_size: number of proteins per batch.
+        maxlen: maximum length, longer proteins are truncated.
+        bucketing: whether to batch proteins of similar length together.
+        shuffle: whether to shuffle the batches at every epoch.
+        seed: random seed for shuffling.
+        padding: 'pre' or 'post', pad before or after each sequence.
+        truncating: 'pre' or 'post', remove residues from sequences
+            longer than `maxlen` either in the beginning or in the end.
+        sparse: whether to generate integer indices instead of one-hot
+            vectors (see `encode_sequences`).
+        dtype: type of the generated inputs.
+        sampler: a sampler such as `BucketSampler` drawing the batches
+            of every epoch, replacing `batch_size`, `bucketing`,
+            `shuffle` and `seed`. Its positions refer to the proteins
+            selected by `indices`.
+        indices: positions of the proteins to generate batches of, e.g.
+            the training set of `splitting.train_test_split`.
+        features: `(residues, F)` per-residue features aligned with the
+            concatenated sequences, e.g. from `features.FeatureStore`.
+            Batches then have a list `[x, features]` as inputs.
+
+    # Returns
+        Batches `(x, y, weights)`, with `x` of shape `(batch_size, length,
+        20)`, or `(batch_size, length)` when `sparse`, the propensities `y`
+        of shape `(batch_size, length, 1)` and weights of shape
+        `(batch_size, length)`. Weights are 1 for residues with a known
+        propensity and 0 elsewhere. Keras only accepts such per-residue
+        weights from models compiled with `sample_weight_mode='temporal'`.
+
+    # Example
+
+    ```python
+        generator = PaddedBatchGenerator(dspp.load_dataset(), batch_size=128)
+        model.compile('adam', loss='mse', sample_weight_mode='temporal')
+        model.fit_generator(generator, epochs=10)
+    ```
+    """
+
+    def __init__(self, sequences, propensities=None, batch_size=128,
+                 maxlen=None, bucketing=True, shuffle=True, seed=None,
+                 padding='pre', truncating='pre', sparse=False,
+                 dtype='float32', sampler=None, indices=None,
+                 features=None):
+        self.positions = None
+        if hasattr(sequences, 'sequence_offsets'):
+            self.sequences = sequences.sequences
+            self.sequence_offsets = sequences.sequence_offsets
+            self.propensities = sequences.propensities
+            self.propensity_offsets = sequences.propensity_offsets
+            self.positions = sequences.indices
+        else:
+            self.sequences, self.sequence_offsets = \
+                concatenate_sequences(sequences)
+            self.propensities, self.propensity_offsets = \
+                _concatenate_values(propensities)
+        if not np.array_equal(self.sequence_offsets,
+                              self.propensity_offsets):
+            raise ValueError('Every sequence needs exactly one propensity '
+                             'per residue.')
+        if self.positions is None:
+            self.positions = np.arange(len(self.sequence_offsets) - 1)
+        if indices is not None:
+            self.positions = self.positions[indices]
+        self.lengths = np.diff(self.sequence_offsets)[self.positions]
+        self.batch_size = batch_size
+        self.maxlen = maxlen
+        self.bucketing = bucketing
+        self.shuffle = shuffle
+        self.padding = padding
+        self.truncating = truncating
+        self.sparse = sparse
+        self.dtype = dtype
+        self.sampler = sampler
+        self.features = features
+        self.epoch = 0
+        self.random = np.random.RandomState(seed)
+        self._make_batches()
+
+    def __len__(self):
+        return len(self.batches)
+
+    def __getitem__(self, index):
+        indices = self.batches[index]
+        with instrumentation.timer('batch', proteins=len(indices)):
+            return self.encode(indices)
+
+    def on_epoch_end(self):
+        """Regroups the proteins into batches."""
+        self.epoch += 1
+        self._make_batches()
+
+    def _make_batches(self):
+        if self.sampler is not None:
+            self.batches = self.sampler.sample(self.epoch)
+            return
+        n = len(self.lengths)
+        if self.shuffle:
+            order = self.random.permutation(n)
+        else:
+            order = np.arange(n)
+        if self.bucketing:
+            order = order[np.argsort(self.lengths[order], kind='mergesort')]
+        self.batches = [order[i:i + self.batch_size]
+                        for i in range(0, n, self.batch_size)]
+        if self.shuffle:
+            self.random.shuffle(self.batches)
+
+    def encode(self, indices):
+        """Encodes and pads the proteins at `indices` into one batch.
+
+        # Arguments
+            indices: positions of the proteins.
+
+        # Returns
+            Tuple `(x, y, weights)`, see the class description.
+        """
+        indices = self.positions[indices]
+        buffer, offsets = gather_sequences(self.sequences,
+                                           self.sequence_offsets, indices)
+        values, _ = gather_sequences(self.propensities,
+                                     self.propensity_offsets, indices)
+        features = None
+        if self.features is not None:
+            features, _ = gather_sequences(self.features,
+                                           self.sequence_offsets, indices)
+        x, y, weights = encode_proteins(
+            buffer, values, offsets, maxlen=_maxlen(offsets, self.maxlen),
+            dtype=self.dtype, padding=self.padding,
+            truncating=self.truncating, sparse=self.sparse,
+            features=features)
+        # Temporal sample weights need targets with a last axis.
+        return x, y[..., np.newaxis], weights
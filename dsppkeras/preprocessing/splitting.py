@@ -0,0 +1,139 @@
+"""Splitting proteins into training and test sets by index."""
+from __future__ import absolute_import
+
+import numpy as np
+
+
+def _length_strata(lengths, bins):
+    """Assigns every protein to one of `bins` length quantiles."""
+    lengths = np.asarray(lengths)
+    edges = np.percentile(lengths, np.linspace(0, 100, bins + 1)[1:-1])
+    return np.searchsorted(edges, lengths, side='right')
+
+
+def _check(n, lengths, groups):
+    if lengths is not None and groups is not None:
+        raise ValueError('Stratify either by `lengths` or by `groups`, '
+                         'not both.')
+    for name, values in (('lengths', lengths), ('groups', groups)):
+        if values is not None and len(values) != n:
+            raise ValueError('`{}` must hold one value per protein, got {} '
+                             'for {} proteins'.format(name, len(values), n))
+
+
+def _group_folds(groups, k, rng):
+    """Assigns whole groups to `k` folds of about equal size.
+
+    Groups are visited from the largest to the smallest, in random order
+    among groups of equal size, and each goes to the smallest fold so far.
+    """
+    labels, inverse, sizes = np.unique(groups, return_inverse=True,
+                                       return_counts=True)
+    order = rng.permutation(len(labels))
+    order = order[np.argsort(-sizes[order], kind='mergesort')]
+    fold_sizes = np.zeros(k, dtype=np.int64)
+    group_folds = np.empty(len(labels), dtype=np.int64)
+    for group in order:
+        fold = np.argmin(fold_sizes)
+        group_folds[group] = fold
+        fold_sizes[fold] += sizes[group]
+    return group_folds[inverse.ravel()]
+
+
+def _folds(n, k, rng, lengths=None, bins=10, groups=None):
+    """Assigns every protein to one of `k` folds."""
+    if groups is not None:
+        return _group_folds(groups, k, rng)
+    strata = np.zeros(n, dtype=np.int64)
+    if lengths is not None:
+        strata = _length_strata(lengths, bins)
+    folds = np.empty(n, dtype=np.int64)
+    for stratum in np.unique(strata):
+        members = rng.permutation(np.flatnonzero(strata == stratum))
+        folds[members] = (np.arange(len(members)) +
+                          rng.integers(k)) % k
+    return folds
+
+
+def train_test_split(n, fraction=0.8, seed=None, lengths=None, bins=10,
+                     groups=None):
+    """Splits proteins into a training and a test set.
+
+    Only indices are returned, use them with `DSPPDataset.subset` or the
+    `indices` of `PaddedBatchGenerator` to avoid copying any data.
+
+    # Arguments
+        n: number of proteins.
+        fraction: fraction of the proteins used for training.
+        seed: seed of the random generator, or a `np.random.Generator`.
+        lengths: `(n,)` protein lengths, to keep the length distribution
+            of both sets alike.
+        bins: number of length quantiles stratified over.
+        groups: `(n,)` group labels, e.g. sequence clusters. Proteins of
+            one group always end up in the same set, which can make the
+            training set smaller than `fraction` asks for.
+
+    # Returns
+        Tuple `(train, test)` of sorted index arrays.
+    """
+    _check(n, lengths, groups)
+    rng = np.random.default_rng(seed)
+    if groups is not None:
+        labels, inverse, sizes = np.unique(groups, return_inverse=True,
+                                           return_counts=True)
+        # As in `_group_folds`, groups are visited from the largest to the
+        # smallest, and those that no longer fit the training set are
+        # skipped for smaller ones.
+        order = rng.permutation(len(labels))
+        order = order[np.argsort(-sizes[order], kind='mergesort')]
+        budget = int(round(fraction * n))
+        in_train = np.zeros(len(labels), dtype=bool)
+        size = 0
+        for group in order:
+            if size + sizes[group] <= budget:
+                in_train[group] = True
+                size += sizes[group]
+        mask = in_train[inverse.ravel()]
+    else:
+        strata = np.zeros(n, dtype=np.int64)
+        if lengths is not None:
+            strata = _length_strata(lengths, bins)
+        mask = np.zeros(n, dtype=bool)
+        for stratum in np.unique(strata):
+            members = rng.permutation(np.flatnonzero(strata == stratum))
+            mask[members[:int(round(fraction * len(members)))]] = True
+    return np.flatnonzero(mask), np.flatnonzero(~mask)
+
+
+def k_fold(n, k=5, seed=None, lengths=None, bins=10, groups=None):
+    """Splits proteins into `k` folds for cross-validation.
+
+    # Arguments
+        n: number of proteins.
+        k: number of folds.
+        seed: seed of the random generator, or a `np.random.Generator`.
+        lengths: `(n,)` protein lengths, to keep the length distribution
+            of all folds alike.
+        bins: number of length quantiles stratified over.
+        groups: `(n,)` group labels, e.g. sequence clusters. Proteins of
+            one group always end up in the same fold.
+
+    # Returns
+        List of `k` tuples `(train, test)` of sorted index arrays, the
+        test sets being the folds.
+
+    # Example
+
+    ```python
+        dataset = dspp.load_dataset()
+        for train, test in k_fold(len(dataset), lengths=dataset.lengths):
+            model.fit_generator(PaddedBatchGenerator(dataset, indices=train))
+    ```
+    """
+    if k < 2:
+        raise ValueError('At least 2 folds are needed, got {}'.format(k))
+    _check(n, lengths, groups)
+    folds = _folds(n, k, np.random.default_rng(seed), lengths=lengths,
+                   bins=bins, groups=groups)
+    return [(np.flatnonzero(folds != fold), np.flatnonzero(folds == fold))
+            for fold in range(k)]
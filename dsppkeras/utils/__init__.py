@@ -1,4 +1,5 @@
 from __future__ import absolute_import
+from . import cache_utils
 from . import data_utils
 from . import generic_utils
 
@@ -0,0 +1,224 @@
+"""Content-addressed store of downloaded files with a bounded size."""
+from __future__ import absolute_import
+
+import json
+import os
+import shutil
+import time
+
+from .data_utils import FileLock
+from .data_utils import get_cache_dir
+from .data_utils import _hash_file
+from .data_utils import _read_digests
+from .data_utils import _write_json
+
+_CATALOG_VERSION = 1
+
+
+def _tree_size(path):
+    """Total size of the files in the directory `path`."""
+    size = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                size += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return size
+
+
+class ContentStore(object):
+    """Keeps files under the directory of their sha256 digest.
+
+    Every entry is a directory `objects/<digest>` holding the file and
+    whatever is derived from it next to it, such as hash sidecars and the
+    binary cache of a dSPP archive, so that versions never overwrite each
+    other. A JSON catalog records the name, origin, size and last access
+    of every entry. Once the entries exceed `max_bytes`, the least
+    recently used ones are evicted, never the most recent one. The
+    catalog is updated under a lock, so the store can be shared by the
+    processes of a host.
+
+    # Arguments
+        cache_subdir: Subdirectory under the Keras cache dir holding the
+            store.
+        cache_dir: Location of the cache, see `get_file`.
+        max_bytes: Budget of the store in bytes, `None` for no limit.
+
+    # Example
+
+    ```python
+        store = ContentStore(max_bytes=10 * 2 ** 30)
+        path = get_file('peptone_dspp.tar.gz', origin, store=store)
+        for entry in store.entries():
+            print(entry['name'], entry['size'], entry['last_access'])
+    ```
+    """
+
+    def __init__(self, cache_subdir='dspp-store', cache_dir=None,
+                 max_bytes=None):
+        self.root = get_cache_dir(cache_subdir, cache_dir)
+        self.max_bytes = max_bytes
+        self.catalog_path = os.path.join(self.root, 'catalog.json')
+
+    def _lock(self):
+        return FileLock(self.catalog_path + '.lock')
+
+    def _read(self):
+        try:
+            with open(self.catalog_path) as f:
+                catalog = json.load(f)
+            if catalog.get('version') == _CATALOG_VERSION:
+                return catalog
+        except (IOError, OSError, ValueError):
+            pass
+        return {'version': _CATALOG_VERSION, 'entries': {}}
+
+    def _write(self, catalog):
+        _write_json(self.catalog_path, catalog, indent=1, sort_keys=True)
+
+    def _object_dir(self, digest):
+        return os.path.join(self.root, 'objects', digest)
+
+    def find(self, digest=None, name=None):
+        """Looks up an entry and marks it as used.
+
+        # Arguments
+            digest: a digest of the file, with any algorithm recorded for
+                the entry.
+            name: name of the file, used when no digest is given; the
+                most recently added entry of that name is found.
+
+        # Returns
+            Path to the stored file, or `None`.
+        """
+        with self._lock():
+            catalog = self._read()
+            entries = catalog['entries']
+            if digest is not None:
+                matches = [key for key, entry in entries.items()
+                           if key == digest or
+                           digest in entry['digests'].values()]
+            else:
+                matches = sorted((key for key, entry in entries.items()
+                                  if entry['name'] == name),
+                                 key=lambda key: entries[key]['added'])
+            for key in reversed(matches):
+                path = os.path.join(self._object_dir(key),
+                                    entries[key]['file'])
+                if os.path.isfile(path):
+                    entries[key]['last_access'] = time.time()
+                    self._write(catalog)
+                    return path
+        return None
+
+    def add(self, fpath, name=None, origin=None, move=True):
+        """Moves or copies a file into the store.
+
+        # Arguments
+            fpath: path of the file.
+            name: name to store the file under, defaults to its basename.
+            origin: where the file came from.
+            move: whether to move `fpath` into the store, e.g. a file
+                just downloaded, rather than copy it and leave it alone.
+
+        # Returns
+            Path to the stored file. If the store already holds the same
+            contents, the stored file is returned, and a moved `fpath`
+            is removed.
+        """
+        name = name or os.path.basename(fpath)
+        digest = _hash_file(fpath, 'sha256')
+        digests = _read_digests(fpath)
+        object_dir = self._object_dir(digest)
+        with self._lock():
+            catalog = self._read()
+            entry = catalog['entries'].get(digest)
+            if entry is not None and os.path.isfile(
+                    os.path.join(object_dir, entry['file'])):
+                if move:
+                    os.remove(fpath)
+            else:
+                if not os.path.isdir(object_dir):
+                    os.makedirs(object_dir)
+                entry = {'file': os.path.basename(name),
+                         'added': time.time()}
+                target = os.path.join(object_dir, entry['file'])
+                transfer = shutil.move if move else shutil.copy2
+                transfer(fpath, target)
+                # Sidecars describe the file and go along with it.
+                for suffix in ('.hash.json', '.index.json'):
+                    if os.path.exists(fpath + suffix):
+                        transfer(fpath + suffix, target + suffix)
+            entry.update({'name': name, 'origin': origin,
+                          'digests': digests,
+                          'size': _tree_size(object_dir),
+                          'last_access': time.time()})
+            catalog['entries'][digest] = entry
+            self._write(catalog)
+            path = os.path.join(object_dir, entry['file'])
+        self.prune()
+        return path
+
+    def entries(self):
+        """Lists the entries of the store.
+
+        # Returns
+            List of dictionaries with the `digest`, `name`, `origin`,
+            `path`, `size` in bytes including derived files, and the
+            `added` and `last_access` times of every entry, least
+            recently used first.
+        """
+        catalog = self._read()
+        entries = []
+        for digest, entry in catalog['entries'].items():
+            entry = dict(entry, digest=digest)
+            entry['path'] = os.path.join(self._object_dir(digest),
+                                         entry.pop('file'))
+            entries.append(entry)
+        return sorted(entries, key=lambda entry: entry['last_access'])
+
+    def prune(self, max_bytes=None, older_than=None):
+        """Evicts the least recently used entries.
+
+        # Arguments
+            max_bytes: budget to prune to, defaults to that of the store.
+            older_than: also evict entries not used for this many
+                seconds.
+
+        # Returns
+            List of the digests of the evicted entries.
+        """
+        if max_bytes is None:
+            max_bytes = self.max_bytes
+        evicted = []
+        with self._lock():
+            catalog = self._read()
+            entries = catalog['entries']
+            for digest, entry in entries.items():
+                entry['size'] = _tree_size(self._object_dir(digest))
+            order = sorted(entries, key=lambda key:
+                           entries[key]['last_access'])
+            total = sum(entry['size'] for entry in entries.values())
+            now = time.time()
+            for digest in order[:-1]:
+                entry = entries[digest]
+                expired = (older_than is not None and
+                           now - entry['last_access'] > older_than)
+                if not expired and (max_bytes is None or
+                                    total <= max_bytes):
+                    continue
+                shutil.rmtree(self._object_dir(digest), ignore_errors=True)
+                total -= entry['size']
+                del entries[digest]
+                evicted.append(digest)
+            self._write(catalog)
+        return evicted
+
+    def remove(self, digest):
+        """Removes an entry and everything derived from it."""
+        with self._lock():
+            catalog = self._read()
+            catalog['entries'].pop(digest, None)
+            shutil.rmtree(self._object_dir(digest), ignore_errors=True)
+            self._write(catalog)
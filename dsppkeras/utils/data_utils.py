@@ -2,64 +2,498 @@
 from __future__ import absolute_import
 from __future__ import print_function
 
-import functools
+import errno
+import gzip
 import tarfile
 import zipfile
 import os
-import sys
 import shutil
+import tempfile
+import time
 import hashlib
+import json
 import six
+from multiprocessing.pool import ThreadPool
+from six.moves.urllib.request import Request
 from six.moves.urllib.request import urlopen
 from six.moves.urllib.error import URLError
 from six.moves.urllib.error import HTTPError
+from six.moves.urllib.parse import urlparse
+from six.moves.urllib.request import pathname2url
 
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+from ..utils import instrumentation
 from ..utils.generic_utils import Progbar
 
 
-if sys.version_info[0] == 2:
-    def urlretrieve(url, filename, reporthook=None, data=None):
-        """Replacement for `urlretrive` for Python 2.
+class FileLock(object):
+    """Advisory lock serializing work on a file across processes.
+
+    The lock is an exclusive `flock` on a lock file, released when the
+    holding process exits, however it exits. Lock files are left in
+    place. If the lock file cannot be created, e.g. next to a file in a
+    read-only directory, it is kept in the `locks` subdir of the Keras
+    cache dir instead, and failing that, nothing is locked. Where `fcntl`
+    is not available, e.g. on Windows, locking is a no-op.
 
-        Under Python 2, `urlretrieve` relies on `FancyURLopener` from legacy
-        `urllib` module, known to have issues with proxy management.
+    # Arguments
+        path: path of the lock file, usually the protected path with a
+            '.lock' suffix.
+        timeout: seconds to wait for the lock, `None` to wait forever.
+        poll_interval: seconds between attempts while waiting with a
+            timeout.
+
+    # Example
+
+    ```python
+        with FileLock(fpath + '.lock'):
+            if not os.path.exists(fpath):
+                download(fpath)
+    ```
+    """
+
+    def __init__(self, path, timeout=None, poll_interval=0.1):
+        self.path = path
+        self.timeout = timeout
+        self.poll_interval = poll_interval
+        self.file = None
+
+    def acquire(self, blocking=True):
+        """Takes the lock.
 
         # Arguments
-            url: url to retrieve.
-            filename: where to store the retrieved data locally.
-            reporthook: a hook function that will be called once
-                on establishment of the network connection and once
-                after each block read thereafter.
-                The hook will be passed three arguments;
-                a count of blocks transferred so far,
-                a block size in bytes, and the total size of the file.
-            data: `data` argument passed to `urlopen`.
+            blocking: whether to wait for the lock.
+
+        # Returns
+            Whether the lock was taken.
+
+        # Raises
+            IOError: if the lock was not free within the timeout.
         """
-        def chunk_read(response, chunk_size=8192, reporthook=None):
-            total_size = response.info().get('Content-Length').strip()
-            total_size = int(total_size)
-            count = 0
-            while 1:
-                chunk = response.read(chunk_size)
-                count += 1
-                if not chunk:
-                    reporthook(count, total_size, total_size)
-                    break
-                if reporthook:
-                    reporthook(count, chunk_size, total_size)
-                yield chunk
+        if fcntl is None:
+            return True
+        self.file = self._open()
+        if self.file is None:
+            return True
+        deadline = None
+        if self.timeout is not None:
+            deadline = time.time() + self.timeout
+        while True:
+            flags = fcntl.LOCK_EX
+            if not blocking or deadline is not None:
+                flags |= fcntl.LOCK_NB
+            try:
+                fcntl.flock(self.file.fileno(), flags)
+                return True
+            except (IOError, OSError) as e:
+                if (e.errno not in (errno.EAGAIN, errno.EWOULDBLOCK,
+                                    errno.EACCES) or
+                        (blocking and deadline is None)):
+                    # A real failure, e.g. no locks on a network file
+                    # system, rather than a lock held by someone else.
+                    self.file.close()
+                    self.file = None
+                    raise
+                if not blocking:
+                    self.file.close()
+                    self.file = None
+                    return False
+                if time.time() > deadline:
+                    self.file.close()
+                    self.file = None
+                    raise IOError('Timed out waiting for the lock '
+                                  '{}'.format(self.path))
+                time.sleep(self.poll_interval)
+
+    def _open(self):
+        """Opens the lock file, falling back to the Keras cache dir."""
+        try:
+            return open(self.path, 'a')
+        except (IOError, OSError) as e:
+            if e.errno not in (errno.EACCES, errno.EPERM, errno.EROFS):
+                raise
+        name = hashlib.sha1(
+            os.path.abspath(self.path).encode('utf-8')).hexdigest()
+        try:
+            return open(os.path.join(get_cache_dir('locks'),
+                                     name + '.lock'), 'a')
+        except (IOError, OSError):
+            return None
+
+    def release(self):
+        if self.file is not None:
+            fcntl.flock(self.file.fileno(), fcntl.LOCK_UN)
+            self.file.close()
+            self.file = None
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *args):
+        self.release()
+
+
+def _replace_file(source, target):
+    """Renames the file `source` to `target`, replacing `target`.
+
+    Unlike `os.rename`, this also replaces an existing `target` on Windows.
+    """
+    if hasattr(os, 'replace'):
+        os.replace(source, target)
+        return
+    try:
+        os.rename(source, target)
+    except OSError:
+        # Python 2 on Windows does not rename over existing files.
+        if not os.path.exists(target):
+            raise
+        os.remove(target)
+        os.rename(source, target)
+
+
+def _write_json(fpath, obj, **kwargs):
+    """Writes `obj` as JSON to `fpath` through a temporary file.
+
+    Readers see either the previous or the new contents, never a partly
+    written file.
+
+    # Arguments
+        fpath: path of the JSON file.
+        obj: object to write.
+        **kwargs: arguments of `json.dump`.
+
+    # Raises
+        IOError or OSError: if the file cannot be written, in which case
+            no temporary file is left behind.
+    """
+    tmp_path = '{}.{}.tmp'.format(fpath, os.getpid())
+    try:
+        with open(tmp_path, 'w') as f:
+            json.dump(obj, f, **kwargs)
+        _replace_file(tmp_path, fpath)
+    except (IOError, OSError):
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+# Size of the byte ranges fetched by every connection of a parallel download.
+_RANGE_CHUNK_SIZE = 1 << 22
+
+
+def _open_range(url, start, end=None, validator=None):
+    """Opens `url`, asking for the bytes from `start` up to `end` inclusive.
+
+    # Arguments
+        validator: ETag or Last-Modified date of the file the range is
+            taken from. If the file has changed since, the server sends
+            the whole new file instead of the range.
+
+    # Returns
+        Tuple `(response, partial)`, where `partial` tells whether the server
+        honoured the range. Otherwise the response holds the whole file.
+    """
+    request = Request(url)
+    request.add_header('Range', 'bytes={}-{}'.format(
+        start, '' if end is None else end))
+    if validator is not None:
+        request.add_header('If-Range', validator)
+    response = urlopen(request)
+    return response, response.getcode() == 206
+
+
+def _read_range(url, start, end, validator=None):
+    """Fetches the bytes from `start` up to `end` inclusive of `url`."""
+    response, partial = _open_range(url, start, end, validator)
+    try:
+        if not partial:
+            raise IOError('Server ignored the byte range request for ' + url)
+        data = response.read()
+    finally:
+        response.close()
+    if len(data) != end - start + 1:
+        raise IOError('Incomplete byte range {}-{} of {}'.format(
+            start, end, url))
+    return data
+
+
+def _validator(response):
+    """Returns the strong ETag or else the Last-Modified date of a file."""
+    info = response.info()
+    etag = info.get('ETag')
+    if etag and not etag.startswith('W/'):
+        return etag
+    return info.get('Last-Modified')
+
+
+def _range_total(content_range):
+    """Total size in a `Content-Range` header like 'bytes */1234'."""
+    try:
+        return int(content_range.rsplit('/', 1)[1])
+    except (AttributeError, IndexError, ValueError):
+        return None
 
-        response = urlopen(url, data)
-        with open(filename, 'wb') as fd:
-            for chunk in chunk_read(response, reporthook=reporthook):
+
+def _origin_url(origin):
+    """Turns a local path into a `file://` url, leaving urls unchanged."""
+    scheme = urlparse(origin).scheme
+    # Single letters are drive names of Windows paths.
+    if len(scheme) > 1:
+        return origin
+    return 'file:' + pathname2url(os.path.abspath(origin))
+
+
+def _download(url, fpath, reporthook=None, hasher=None, connections=1,
+              chunk_size=8192):
+    """Downloads `url` to `fpath`, resuming an earlier partial download.
+
+    Bytes are written to `fpath + '.part'`, which is renamed to `fpath`
+    once complete. The partial file always holds a contiguous prefix of the
+    file, so an interrupted download is continued with an HTTP Range
+    request next time. The ETag or Last-Modified date of the file is kept
+    in `fpath + '.part.json'` and sent as `If-Range`, so the download
+    starts over if the file changed in between, and a partial file that
+    the server says is already complete is just renamed. With several
+    `connections`, the rest of the file is fetched as byte ranges in a
+    thread pool and written in order.
+
+    # Arguments
+        url: url to retrieve.
+        fpath: where to store the retrieved data locally.
+        reporthook: a hook function called with the number of bytes
+            written so far, a block size of 1 and the total size of the
+            file, in the style of `urlretrieve`.
+        hasher: a `hashlib` hash object updated with the bytes of the file
+            as they arrive.
+        connections: number of parallel connections.
+        chunk_size: bytes to read at a time from a single connection.
+    """
+    part_fpath = fpath + '.part'
+    validator_path = part_fpath + '.json'
+    start = 0
+    validator = None
+    if os.path.exists(part_fpath):
+        # A prefix is only resumed if the server can tell whether the file
+        # changed since, so stale bytes are never spliced onto new ones.
+        try:
+            with open(validator_path) as f:
+                validator = json.load(f)['validator']
+            start = os.path.getsize(part_fpath)
+        except (IOError, OSError, ValueError, KeyError, TypeError):
+            validator = None
+    try:
+        response, partial = _open_range(url, start, validator=validator)
+    except HTTPError as e:
+        if e.code != 416 or not start:
+            raise
+        if _range_total(e.info().get('Content-Range')) == start:
+            # The part file is complete, only the rename was missed.
+            response, partial = None, True
+        else:
+            start = 0
+            response, partial = _open_range(url, start)
+    try:
+        if response is None:
+            total_size = start
+        else:
+            if not partial:
+                start = 0
+            length = response.info().get('Content-Length')
+            total_size = start + int(length) if length is not None else -1
+            if not start:
+                validator = _validator(response)
+                if validator is not None:
+                    with open(validator_path, 'w') as f:
+                        json.dump({'validator': validator}, f)
+                elif os.path.exists(validator_path):
+                    os.remove(validator_path)
+
+        with open(part_fpath, 'r+b' if start else 'wb') as fd:
+            fd.seek(start)
+            fd.truncate()
+            if hasher is not None and start:
+                fd.seek(0)
+                for chunk in iter(lambda: fd.read(65535), b''):
+                    hasher.update(chunk)
+
+            def write(chunk, position):
                 fd.write(chunk)
-else:
-    from six.moves.urllib.request import urlretrieve
+                if hasher is not None:
+                    hasher.update(chunk)
+                if reporthook:
+                    reporthook(position, 1, total_size)
+
+            position = start
+            if reporthook:
+                reporthook(position, 1, total_size)
+            if response is None:
+                pass
+            elif connections > 1 and partial and total_size > 0:
+                response.close()
+                ranges = [(i, min(i + _RANGE_CHUNK_SIZE, total_size) - 1)
+                          for i in range(start, total_size,
+                                         _RANGE_CHUNK_SIZE)]
+                pool = ThreadPool(connections)
+                try:
+                    # `imap` yields in order while workers fetch ahead.
+                    for chunk in pool.imap(
+                            lambda r: _read_range(url, r[0], r[1],
+                                                  validator), ranges):
+                        position += len(chunk)
+                        write(chunk, position)
+                finally:
+                    pool.terminate()
+            else:
+                for chunk in iter(lambda: response.read(chunk_size), b''):
+                    position += len(chunk)
+                    write(chunk, position)
+    finally:
+        if response is not None:
+            response.close()
+    if total_size >= 0 and position != total_size:
+        raise IOError('Incomplete download of {}: got {} of {} '
+                      'bytes'.format(url, position, total_size))
+    instrumentation.count('download.bytes', position - start, url=url,
+                          resumed_from=start)
+    _replace_file(part_fpath, fpath)
+    if os.path.exists(validator_path):
+        os.remove(validator_path)
+
+
+def _manifest_path(file_path):
+    """Location of the extraction manifest of the archive `file_path`."""
+    return file_path + '.manifest.json'
 
 
-def _extract_archive(file_path, path='.', archive_format='auto'):
+def _is_extracted(file_path, path, digest):
+    """Whether the manifest shows `file_path` completely extracted to `path`.
+
+    The manifest must belong to the current contents of the archive and
+    every extracted file must still be present with its recorded size.
+    """
+    try:
+        with open(_manifest_path(file_path)) as f:
+            manifest = json.load(f)
+    except (IOError, OSError, ValueError):
+        return False
+    if (manifest.get('digest') != digest or
+            manifest.get('path') != os.path.abspath(path)):
+        return False
+    for name, size in manifest['members']:
+        target = os.path.join(path, name)
+        if size is None:
+            if not os.path.isdir(target):
+                return False
+        elif (not os.path.isfile(target) or
+              os.path.getsize(target) != size):
+            return False
+    return True
+
+
+def _extract_tar(file_path, path, workers):
+    with tarfile.open(file_path) as archive:
+        archive.extractall(path)
+        return [(member.name, member.size if member.isfile() else None)
+                for member in archive.getmembers()
+                if member.isfile() or member.isdir()]
+
+
+def _makedirs(path):
+    """Creates a directory and its parents, unless it exists."""
+    try:
+        os.makedirs(path)
+    except OSError:
+        if not os.path.isdir(path):
+            raise
+
+
+def _zip_member_path(path, name):
+    """Where `ZipFile.extract` puts the member `name` under `path`."""
+    name = name.replace('/', os.path.sep)
+    if os.path.altsep:
+        name = name.replace(os.path.altsep, os.path.sep)
+    name = os.path.splitdrive(name)[1]
+    parts = [part for part in name.split(os.path.sep)
+             if part not in ('', os.path.curdir, os.path.pardir)]
+    return os.path.join(path, *parts)
+
+
+def _extract_zip(file_path, path, workers):
+    """Extracts a zip file, sharing its members out among threads.
+
+    Every thread reads through its own handle of the archive, and
+    members are dealt out largest first to balance the threads. All
+    directories are created beforehand, as `ZipFile.extract` fails when
+    two threads create the same one.
+    """
+    with zipfile.ZipFile(file_path) as archive:
+        infos = archive.infolist()
+    for info in infos:
+        target = _zip_member_path(path, info.filename)
+        if not info.filename.endswith('/'):
+            target = os.path.dirname(target)
+        _makedirs(target)
+    files = [info for info in infos if not info.filename.endswith('/')]
+    order = sorted(files, key=lambda info: info.file_size, reverse=True)
+    chunks = [order[i::workers] for i in range(workers)]
+
+    def extract(chunk):
+        with zipfile.ZipFile(file_path) as archive:
+            for info in chunk:
+                archive.extract(info, path)
+
+    if workers > 1 and len(files) > 1:
+        pool = ThreadPool(workers)
+        try:
+            pool.map(extract, chunks)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        extract(files)
+    return [(info.filename.rstrip('/'),
+             None if info.filename.endswith('/') else info.file_size)
+            for info in infos]
+
+
+def _merge(source, target):
+    """Moves `source` to `target`, merging directories into existing ones.
+
+    Files are renamed over files of the same name, as extracting over
+    them would, but nothing already in `target` that `source` does not
+    hold is removed.
+    """
+    if os.path.isdir(source) and not os.path.islink(source) and \
+            os.path.isdir(target) and not os.path.islink(target):
+        for name in os.listdir(source):
+            _merge(os.path.join(source, name), os.path.join(target, name))
+        return
+    if os.path.isdir(source) and os.path.lexists(target) and \
+            not os.path.isdir(target):
+        os.remove(target)
+    if os.path.isdir(source):
+        os.rename(source, target)
+    else:
+        _replace_file(source, target)
+
+
+def _extract_archive(file_path, path='.', archive_format='auto', workers=4):
     """Extracts an archive if it matches tar, tar.gz, tar.bz, or zip formats.
 
+    Members are extracted into a temporary directory within `path` and
+    then renamed into place, so an interrupted extraction never leaves
+    half-written files at their final location, and a lock lets only one
+    process at a time extract the same archive. A manifest
+    of the extracted members and the digest of the archive is stored
+    next to it, and an unchanged archive whose members are all in place
+    is not extracted again. Zip members are extracted by a pool of
+    threads.
+
     # Arguments
         file_path: path to the archive file
         path: path to extract the archive file
@@ -68,42 +502,244 @@ def _extract_archive(file_path, path='.', archive_format='auto'):
             'tar' includes tar, tar.gz, and tar.bz files.
             The default 'auto' is ['tar', 'zip'].
             None or an empty list will return no matches found.
+        workers: number of threads extracting zip files.
 
     # Returns
         True if a match was found and an archive extraction was completed,
-        False otherwise.
+        or had been completed before, False otherwise.
     """
     if archive_format is None:
         return False
-    if archive_format is 'auto':
+    if archive_format == 'auto':
         archive_format = ['tar', 'zip']
     if isinstance(archive_format, six.string_types):
         archive_format = [archive_format]
 
     for archive_type in archive_format:
-        if archive_type is 'tar':
-            open_fn = tarfile.open
+        if archive_type == 'tar':
+            extract_fn = _extract_tar
             is_match_fn = tarfile.is_tarfile
-        if archive_type is 'zip':
-            open_fn = zipfile.ZipFile
+        elif archive_type == 'zip':
+            extract_fn = _extract_zip
             is_match_fn = zipfile.is_zipfile
+        else:
+            continue
+        if not is_match_fn(file_path):
+            continue
 
-        if is_match_fn(file_path):
-            with open_fn(file_path) as archive:
-                try:
-                    archive.extractall(path)
-                except (tarfile.TarError, RuntimeError,
-                        KeyboardInterrupt):
-                    if os.path.exists(path):
-                        if os.path.isfile(path):
-                            os.remove(path)
-                        else:
-                            shutil.rmtree(path)
-                    raise
-            return True
+        with FileLock(file_path + '.extract.lock'):
+            _extract_unless_done(file_path, path, extract_fn, workers)
+        return True
     return False
 
 
+def _extract_unless_done(file_path, path, extract_fn, workers):
+    """Extracts an archive unless its manifest shows it extracted."""
+    digest = _hash_file(file_path)
+    if _is_extracted(file_path, path, digest):
+        instrumentation.count('extract.skipped', path=file_path)
+        return
+    if not os.path.exists(path):
+        os.makedirs(path)
+    tmp_path = tempfile.mkdtemp(dir=path, prefix='.extract-')
+    try:
+        with instrumentation.timer('extract', path=file_path):
+            members = extract_fn(file_path, tmp_path, workers)
+        instrumentation.count('extract.members', len(members),
+                              path=file_path)
+        for name in sorted(os.listdir(tmp_path)):
+            _merge(os.path.join(tmp_path, name), os.path.join(path, name))
+    finally:
+        shutil.rmtree(tmp_path, ignore_errors=True)
+
+    manifest = {'digest': digest, 'path': os.path.abspath(path),
+                'members': members}
+    try:
+        _write_json(_manifest_path(file_path), manifest)
+    except (IOError, OSError):
+        # Without a manifest the archive is only extracted again.
+        pass
+
+
+def _index_path(fpath):
+    """Location of the member index of the archive `fpath`."""
+    return fpath + '.index.json'
+
+
+def _compression(fpath):
+    """Tells 'gzip', 'bz2', 'xz' or `None` from the first bytes of a file."""
+    with open(fpath, 'rb') as f:
+        magic = f.read(6)
+    if magic.startswith(b'\x1f\x8b'):
+        return 'gzip'
+    if magic.startswith(b'BZh'):
+        return 'bz2'
+    if magic == b'\xfd7zXZ\x00':
+        return 'xz'
+    return None
+
+
+def index_archive(fpath):
+    """Returns the member index of a tar archive, building it if needed.
+
+    The index records the offset of the data of every regular member in
+    the uncompressed tar stream, and its size. It is stored next to the
+    archive together with the size, modification time and inode of the
+    archive, and rebuilt once the archive changes. Building it reads the
+    archive once as a stream.
+
+    # Arguments
+        fpath: path to a tar, tar.gz or tar.bz archive.
+
+    # Returns
+        List of `{'name', 'offset', 'size'}` dictionaries, one per regular
+        member, in archive order.
+    """
+    try:
+        with open(_index_path(fpath)) as f:
+            index = json.load(f)
+        if index.get('signature') == _file_signature(fpath):
+            return index['members']
+    except (IOError, OSError, ValueError, KeyError):
+        pass
+
+    with tarfile.open(fpath, 'r|*') as tar:
+        members = [{'name': member.name, 'offset': member.offset_data,
+                    'size': member.size}
+                   for member in tar if member.isfile()]
+    index = {'signature': _file_signature(fpath), 'members': members}
+    try:
+        _write_json(_index_path(fpath), index)
+    except (IOError, OSError):
+        # The index only saves scanning, e.g. in a read-only directory.
+        pass
+    return members
+
+
+class _MemberFile(object):
+    """Read-only file object for `size` bytes of `f` from its position.
+
+    Closing it closes `f` and, if given, the object `owner` it belongs to.
+    """
+
+    def __init__(self, f, size, owner=None):
+        self.f = f
+        self.remaining = size
+        self.owner = owner
+
+    def read(self, size=-1):
+        if size is None or size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.f.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def close(self):
+        self.f.close()
+        if self.owner is not None:
+            self.owner.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def open_archive_member(fpath, name=None):
+    """Opens a member of a tar archive with a seek, using its index.
+
+    Members of uncompressed archives are read directly from their offset.
+    In gzip compressed archives only the bytes up to the member are
+    decompressed and no tar headers are parsed. Other compressions fall
+    back to `tarfile`.
+
+    # Arguments
+        fpath: path to a tar, tar.gz or tar.bz archive.
+        name: name of the member, `None` for the first regular file.
+
+    # Returns
+        A binary file object holding the member.
+
+    # Raises
+        KeyError: if the archive has no such member.
+    """
+    members = index_archive(fpath)
+    matches = [member for member in members
+               if name is None or member['name'] == name]
+    if not matches:
+        raise KeyError('No member {} in {}'.format(
+            'files' if name is None else name, fpath))
+    member = matches[0]
+
+    compression = _compression(fpath)
+    if compression is None:
+        f = open(fpath, 'rb')
+    elif compression == 'gzip':
+        f = gzip.open(fpath, 'rb')
+    else:
+        tar = tarfile.open(fpath)
+        return _MemberFile(tar.extractfile(member['name']), member['size'],
+                           owner=tar)
+    f.seek(member['offset'])
+    return _MemberFile(f, member['size'])
+
+
+def repack_archive(fpath, repacked_fpath=None, chunk_size=1 << 20):
+    """Decompresses a tar archive so that its members can be seeked to.
+
+    # Arguments
+        fpath: path to a tar.gz archive.
+        repacked_fpath: path of the uncompressed tar, by default `fpath`
+            with the '.gz' or '.tgz' extension replaced by '.tar'.
+        chunk_size: bytes to copy at a time.
+
+    # Returns
+        Path to the uncompressed archive, which is indexed as well.
+    """
+    if repacked_fpath is None:
+        root = fpath
+        for extension in ('.tar.gz', '.tgz', '.gz'):
+            if fpath.endswith(extension):
+                root = fpath[:-len(extension)]
+                break
+        repacked_fpath = root + '.tar'
+    tmp_path = '{}.{}.tmp'.format(repacked_fpath, os.getpid())
+    try:
+        with gzip.open(fpath, 'rb') as src, open(tmp_path, 'wb') as dst:
+            shutil.copyfileobj(src, dst, chunk_size)
+        _replace_file(tmp_path, repacked_fpath)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    index_archive(repacked_fpath)
+    return repacked_fpath
+
+
+def get_cache_dir(cache_subdir='datasets', cache_dir=None):
+    """Returns a directory of the Keras cache, creating it if needed.
+
+    # Arguments
+        cache_subdir: Subdirectory under the Keras cache dir. If an
+            absolute path `/path/to/folder` is specified it is used as is.
+        cache_dir: Location of the cache, when None it defaults to the
+            [Keras Directory](/faq/#where-is-the-keras-configuration-filed-stored),
+            or `/tmp/.keras` if that is not writable.
+
+    # Returns
+        Path to the directory.
+    """
+    if cache_dir is None:
+        cache_dir = os.path.expanduser(os.path.join('~', '.keras'))
+    datadir_base = os.path.expanduser(cache_dir)
+    if not os.access(datadir_base, os.W_OK):
+        datadir_base = os.path.join('/tmp', '.keras')
+    datadir = os.path.join(datadir_base, cache_subdir)
+    if not os.path.exists(datadir):
+        os.makedirs(datadir)
+    return datadir
+
+
 def get_file(fname,
              origin,
              untar=False,
@@ -113,7 +749,10 @@ def get_file(fname,
              hash_algorithm='auto',
              extract=False,
              archive_format='auto',
-             cache_dir=None):
+             cache_dir=None,
+             connections=1,
+             lock_timeout=None,
+             store=None):
     """Downloads a file from a URL if it not already in the cache.
 
     By default the file at the url `origin` is downloaded to the
@@ -128,18 +767,19 @@ def get_file(fname,
     # Arguments
         fname: Name of the file. If an absolute path `/path/to/file.txt` is
             specified the file will be saved at that location.
-        origin: Original URL of the file.
+        origin: Original URL of the file, or a `file://` url or path of
+            a local file to copy.
         untar: Deprecated in favor of 'extract'.
             boolean, whether the file should be decompressed
         md5_hash: Deprecated in favor of 'file_hash'.
             md5 hash of the file for verification
         file_hash: The expected hash string of the file after download.
-            The sha256 and md5 hash algorithms are both supported.
+            The sha256, blake2b and md5 hash algorithms are supported.
         cache_subdir: Subdirectory under the Keras cache dir where the file is
             saved. If an absolute path `/path/to/folder` is
             specified the file will be saved at that location.
         hash_algorithm: Select the hash algorithm to verify the file.
-            options are 'md5', 'sha256', and 'auto'.
+            options are 'md5', 'sha256', 'blake2b', and 'auto'.
             The default 'auto' detects the hash algorithm in use.
         extract: True tries extracting the file as an Archive, like tar or zip.
         archive_format: Archive format to try for extracting the file.
@@ -149,21 +789,21 @@ def get_file(fname,
             None or an empty list will return no matches found.
         cache_dir: Location to store cached files, when None it
             defaults to the [Keras Directory](/faq/#where-is-the-keras-configuration-filed-stored).
+        connections: Number of parallel connections to download with,
+            if the server supports byte ranges.
+        lock_timeout: Seconds to wait for another process downloading
+            the same file, `None` to wait until it is done.
+        store: A `cache_utils.ContentStore` to keep the file in, under its
+            digest, instead of at `fname`. The stored file is found by
+            `file_hash` when given, by `fname` otherwise.
 
     # Returns
         Path to the downloaded file
     """
-    if cache_dir is None:
-        cache_dir = os.path.expanduser(os.path.join('~', '.keras'))
     if md5_hash is not None and file_hash is None:
         file_hash = md5_hash
         hash_algorithm = 'md5'
-    datadir_base = os.path.expanduser(cache_dir)
-    if not os.access(datadir_base, os.W_OK):
-        datadir_base = os.path.join('/tmp', '.keras')
-    datadir = os.path.join(datadir_base, cache_subdir)
-    if not os.path.exists(datadir):
-        os.makedirs(datadir)
+    datadir = get_cache_dir(cache_subdir, cache_dir)
 
     if untar:
         untar_fpath = os.path.join(datadir, fname)
@@ -171,47 +811,81 @@ def get_file(fname,
     else:
         fpath = os.path.join(datadir, fname)
 
-    download = False
-    if os.path.exists(fpath):
-        # File found; verify integrity if a hash was provided.
-        if file_hash is not None:
-            if not validate_file(fpath, file_hash, algorithm=hash_algorithm):
-                print('A local file was found, but it seems to be '
-                      'incomplete or outdated because the ' + hash_algorithm +
-                      ' file hash does not match the original value of ' +
-                      file_hash + ' so we will re-download the data.')
-                download = True
-    else:
-        download = True
+    # Only one process per host downloads, the others wait and find the
+    # file in place.
+    lock = FileLock(fpath + '.lock', timeout=lock_timeout)
+    if not lock.acquire(blocking=False):
+        print('Waiting for another process fetching', fpath)
+        lock.acquire()
+    try:
+        stored = None
+        if store is not None:
+            stored = store.find(digest=file_hash, name=fname)
+        download = False
+        if stored is not None:
+            fpath = stored
+        elif os.path.exists(fpath):
+            # File found; verify integrity if a hash was provided.
+            if file_hash is not None:
+                if not validate_file(fpath, file_hash,
+                                     algorithm=hash_algorithm):
+                    print('A local file was found, but it seems to be '
+                          'incomplete or outdated because the ' +
+                          hash_algorithm + ' file hash does not match the '
+                          'original value of ' + file_hash +
+                          ' so we will re-download the data.')
+                    download = True
+        else:
+            download = True
 
-    if download:
-        print('Downloading data from', origin)
-        progbar = None
+        if download:
+            print('Downloading data from', origin)
 
-        def dl_progress(count, block_size, total_size, progbar=None):
-            if progbar is None:
-                progbar = Progbar(total_size)
+            class ProgressTracker(object):
+                # Maintain progbar for the lifetime of download.
+                progbar = None
+
+            def dl_progress(count, block_size, total_size):
+                if ProgressTracker.progbar is None:
+                    # Redraw at most once per 0.1% of the bytes.
+                    ProgressTracker.progbar = Progbar(
+                        total_size, min_delta=max(total_size // 1000, 0))
+                ProgressTracker.progbar.update(count * block_size)
+
+            # Hash while downloading, so the digest never needs a second pass.
+            if file_hash is not None:
+                hasher = _get_hasher(file_hash, hash_algorithm)
             else:
-                progbar.update(count * block_size)
+                hasher = hashlib.sha256()
 
-        error_msg = 'URL fetch failure on {}: {} -- {}'
-        try:
+            error_msg = 'URL fetch failure on {}: {} -- {}'
             try:
-                urlretrieve(origin, fpath,
-                            functools.partial(dl_progress, progbar=progbar))
-            except URLError as e:
-                raise Exception(error_msg.format(origin, e.errno, e.reason))
+                with instrumentation.timer('download', url=origin) as stage:
+                    _download(_origin_url(origin), fpath, dl_progress,
+                              hasher=hasher, connections=connections)
+                    stage.update(bytes=os.path.getsize(fpath))
             except HTTPError as e:
                 raise Exception(error_msg.format(origin, e.code, e.msg))
-        except (Exception, KeyboardInterrupt) as e:
-            if os.path.exists(fpath):
+            except URLError as e:
+                raise Exception(error_msg.format(origin, e.errno, e.reason))
+
+            if file_hash is not None and hasher.hexdigest() != str(file_hash):
                 os.remove(fpath)
-            raise
-        progbar = None
+                raise ValueError('The downloaded file {} does not match the '
+                                 'expected {} hash {}.'.format(
+                                     fpath, hasher.name, file_hash))
+            _write_digest(fpath, hasher.name, hasher.hexdigest())
+
+        if store is not None and stored is None:
+            # Only a file downloaded just now is moved, never one that
+            # was already there, such as an archive given by its path.
+            fpath = store.add(fpath, name=fname, origin=origin,
+                              move=download)
+    finally:
+        lock.release()
 
     if untar:
-        if not os.path.exists(untar_fpath):
-            _extract_archive(fpath, datadir, archive_format='tar')
+        _extract_archive(fpath, datadir, archive_format='tar')
         return untar_fpath
 
     if extract:
@@ -220,8 +894,61 @@ def get_file(fname,
     return fpath
 
 
+# Hash algorithms told apart by the length of their hex digest in 'auto' mode.
+_HASH_ALGORITHMS = {32: 'md5', 64: 'sha256', 128: 'blake2b'}
+
+
+def _sidecar_path(fpath):
+    """Location of the metadata file caching the digests of `fpath`."""
+    return fpath + '.hash.json'
+
+
+def _file_signature(fpath):
+    """Size, modification time and inode of a file, for change detection."""
+    stat = os.stat(fpath)
+    return {'size': stat.st_size,
+            'mtime': getattr(stat, 'st_mtime_ns', stat.st_mtime),
+            'inode': stat.st_ino}
+
+
+def _read_digests(fpath):
+    """Returns the digests cached for `fpath`, if it has not changed since.
+
+    # Returns
+        Dictionary of hex digests by algorithm, empty when the sidecar is
+        missing or was written for a different version of the file.
+    """
+    try:
+        with open(_sidecar_path(fpath)) as f:
+            meta = json.load(f)
+        if meta.get('signature') == _file_signature(fpath):
+            return meta.get('digests', {})
+    except (IOError, OSError, ValueError):
+        pass
+    return {}
+
+
+def _write_digest(fpath, algorithm, digest):
+    """Records the digest of `fpath` in its sidecar metadata file.
+
+    Failures, e.g. in a read-only cache directory, are ignored since the
+    sidecar only saves rehashing.
+    """
+    digests = _read_digests(fpath)
+    digests[algorithm] = digest
+    meta = {'signature': _file_signature(fpath), 'digests': digests}
+    try:
+        _write_json(_sidecar_path(fpath), meta)
+    except (IOError, OSError):
+        pass
+
+
 def _hash_file(fpath, algorithm='sha256', chunk_size=65535):
-    """Calculates a file sha256 or md5 hash.
+    """Calculates a file sha256, blake2b or md5 hash.
+
+    Digests are cached in a sidecar file next to `fpath` together with the
+    size, modification time and inode of the file, so that an unchanged
+    file is not read again.
 
     # Example
 
@@ -233,44 +960,64 @@ def _hash_file(fpath, algorithm='sha256', chunk_size=65535):
 
     # Arguments
         fpath: path to the file being validated
-        algorithm: hash algorithm, one of 'auto', 'sha256', or 'md5'.
-            The default 'auto' detects the hash algorithm in use.
+        algorithm: hash algorithm, one of 'auto', 'sha256', 'blake2b',
+            or 'md5'. 'auto' uses sha256.
         chunk_size: Bytes to read at a time, important for large files.
 
     # Returns
         The file hash
     """
-    if (algorithm is 'sha256') or (algorithm is 'auto' and len(hash) is 64):
-        hasher = hashlib.sha256()
-    else:
-        hasher = hashlib.md5()
+    if algorithm == 'auto':
+        algorithm = 'sha256'
+    digest = _read_digests(fpath).get(algorithm)
+    if digest is not None:
+        instrumentation.count('hash.cached', path=fpath,
+                              algorithm=algorithm)
+        return digest
 
-    with open(fpath, 'rb') as fpath_file:
+    hasher = hashlib.new(algorithm)
+    with instrumentation.timer('hash', path=fpath, algorithm=algorithm,
+                               bytes=os.path.getsize(fpath)), \
+            open(fpath, 'rb') as fpath_file:
         for chunk in iter(lambda: fpath_file.read(chunk_size), b''):
             hasher.update(chunk)
 
-    return hasher.hexdigest()
+    digest = hasher.hexdigest()
+    _write_digest(fpath, algorithm, digest)
+    return digest
+
+
+def _get_hasher(file_hash, algorithm='auto'):
+    """Returns a hash object for verifying a file against `file_hash`.
+
+    # Arguments
+        file_hash: The expected hash string of the file.
+        algorithm: Hash algorithm, one of 'auto', 'sha256', 'blake2b',
+            or 'md5'. The default 'auto' detects the hash algorithm in use.
+
+    # Returns
+        A `hashlib` hash object.
+    """
+    if algorithm == 'auto':
+        algorithm = _HASH_ALGORITHMS.get(len(file_hash), 'md5')
+    return hashlib.new(algorithm)
 
 
 def validate_file(fpath, file_hash, algorithm='auto', chunk_size=65535):
-    """Validates a file against a sha256 or md5 hash.
+    """Validates a file against a sha256, blake2b or md5 hash.
 
     # Arguments
         fpath: path to the file being validated
         file_hash:  The expected hash string of the file.
-            The sha256 and md5 hash algorithms are both supported.
-        algorithm: Hash algorithm, one of 'auto', 'sha256', or 'md5'.
-            The default 'auto' detects the hash algorithm in use.
+            The sha256, blake2b and md5 hash algorithms are supported.
+        algorithm: Hash algorithm, one of 'auto', 'sha256', 'blake2b',
+            or 'md5'. The default 'auto' detects the hash algorithm in use.
         chunk_size: Bytes to read at a time, important for large files.
 
     # Returns
         Whether the file is valid
     """
-    if ((algorithm is 'sha256') or
-            (algorithm is 'auto' and len(file_hash) is 64)):
-        hasher = 'sha256'
-    else:
-        hasher = 'md5'
+    hasher = _get_hasher(file_hash, algorithm).name
 
     if str(_hash_file(fpath, hasher, chunk_size)) == str(file_hash):
         return True
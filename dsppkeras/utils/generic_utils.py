@@ -1,8 +1,6 @@
 """Python utilities required by Keras."""
 from __future__ import absolute_import
 
-import numpy as np
-
 import time
 import sys
 import six
@@ -207,22 +205,76 @@ def func_load(code, defaults=None, closure=None, globs=None):
 class Progbar(object):
     """Displays a progress bar.
 
+    On a terminal the bar is redrawn in place. Otherwise, e.g. when the
+    output goes to a log file, a plain line is printed every time progress
+    passes another `line_percent` percent of the target.
+
     # Arguments
-        target: Total number of steps expected.
+        target: Total number of steps expected, `None` if unknown.
         interval: Minimum visual progress update interval (in seconds).
+        min_delta: Minimum number of steps between visual progress
+            updates, e.g. bytes for a download.
+        line_percent: Percentage of the target between the lines printed
+            when the output is not a terminal.
+
+    # Raises
+        ValueError: if `line_percent` is not positive.
     """
 
-    def __init__(self, target, width=30, verbose=1, interval=0.05):
+    def __init__(self, target, width=30, verbose=1, interval=0.05,
+                 min_delta=0, line_percent=10):
+        if line_percent <= 0:
+            raise ValueError('line_percent must be positive, '
+                             'got {}'.format(line_percent))
+        if target is not None and target <= 0:
+            target = None
         self.width = width
         self.target = target
         self.sum_values = {}
         self.unique_values = []
         self.start = time.time()
         self.last_update = 0
+        self.last_current = 0
         self.interval = interval
+        self.min_delta = min_delta
         self.total_width = 0
         self.seen_so_far = 0
         self.verbose = verbose
+        self.dynamic = ((hasattr(sys.stdout, 'isatty') and
+                         sys.stdout.isatty()) or
+                        'ipykernel' in sys.modules)
+        # Formats of the step counts, computed once.
+        if target is None:
+            self._count_format = '%d/Unknown'
+        else:
+            self._count_format = '%%%dd/%d' % (len(str(int(target))),
+                                               target)
+        self.line_step = None
+        if target is not None:
+            self.line_step = target * line_percent / 100.
+        self.next_line = self.line_step
+
+    def _info(self, current, now):
+        """Formats the timing and the averages of the values."""
+        if self.target is not None and current < self.target:
+            if current:
+                time_per_unit = (now - self.start) / current
+            else:
+                time_per_unit = 0
+            info = ' - ETA: %ds' % (time_per_unit * (self.target - current))
+        else:
+            info = ' - %ds' % (now - self.start)
+        for k in self.unique_values:
+            info += ' - %s:' % k
+            if isinstance(self.sum_values[k], list):
+                avg = self.sum_values[k][0] / max(1, self.sum_values[k][1])
+                if abs(avg) > 1e-3:
+                    info += ' %.4f' % avg
+                else:
+                    info += ' %.4e' % avg
+            else:
+                info += ' %s' % self.sum_values[k]
+        return info
 
     def update(self, current, values=None, force=False):
         """Updates the progress bar.
@@ -233,86 +285,79 @@ class Progbar(object):
                 The progress bar will display averages for these values.
             force: Whether to force visual progress update.
         """
-        values = values or []
-        for k, v in values:
-            if k not in self.sum_values:
-                self.sum_values[k] = [v * (current - self.seen_so_far),
-                                      current - self.seen_so_far]
-                self.unique_values.append(k)
-            else:
-                self.sum_values[k][0] += v * (current - self.seen_so_far)
-                self.sum_values[k][1] += (current - self.seen_so_far)
+        if values:
+            for k, v in values:
+                if k not in self.sum_values:
+                    self.sum_values[k] = [v * (current - self.seen_so_far),
+                                          current - self.seen_so_far]
+                    self.unique_values.append(k)
+                else:
+                    self.sum_values[k][0] += v * (current - self.seen_so_far)
+                    self.sum_values[k][1] += (current - self.seen_so_far)
         self.seen_so_far = current
 
+        finished = self.target is not None and current >= self.target
+        if not (force or finished):
+            if current - self.last_current < self.min_delta:
+                return
+            if self.verbose == 1 and not self.dynamic and (
+                    self.next_line is None or current < self.next_line):
+                return
         now = time.time()
-        if self.verbose == 1:
-            if not force and (now - self.last_update) < self.interval:
+
+        if self.verbose == 1 and self.dynamic:
+            if not (force or finished) and \
+                    (now - self.last_update) < self.interval:
                 return
 
             prev_total_width = self.total_width
             sys.stdout.write('\b' * prev_total_width)
             sys.stdout.write('\r')
 
-            numdigits = int(np.floor(np.log10(self.target))) + 1
-            barstr = '%%%dd/%%%dd [' % (numdigits, numdigits)
-            bar = barstr % (current, self.target)
-            prog = float(current) / self.target
-            prog_width = int(self.width * prog)
-            if prog_width > 0:
-                bar += ('=' * (prog_width - 1))
-                if current < self.target:
-                    bar += '>'
-                else:
-                    bar += '='
-            bar += ('.' * (self.width - prog_width))
-            bar += ']'
-            sys.stdout.write(bar)
-            self.total_width = len(bar)
-
-            if current:
-                time_per_unit = (now - self.start) / current
-            else:
-                time_per_unit = 0
-            eta = time_per_unit * (self.target - current)
-            info = ''
-            if current < self.target:
-                info += ' - ETA: %ds' % eta
-            else:
-                info += ' - %ds' % (now - self.start)
-            for k in self.unique_values:
-                info += ' - %s:' % k
-                if isinstance(self.sum_values[k], list):
-                    avg = self.sum_values[k][0] / max(1, self.sum_values[k][1])
-                    if abs(avg) > 1e-3:
-                        info += ' %.4f' % avg
+            bar = self._count_format % current
+            if self.target is not None:
+                prog_width = int(self.width * float(current) / self.target)
+                bar += ' ['
+                if prog_width > 0:
+                    bar += ('=' * (prog_width - 1))
+                    if current < self.target:
+                        bar += '>'
                     else:
-                        info += ' %.4e' % avg
-                else:
-                    info += ' %s' % self.sum_values[k]
-
-            self.total_width += len(info)
+                        bar += '='
+                bar += ('.' * (self.width - prog_width))
+                bar += ']'
+            info = self._info(current, now)
+            self.total_width = len(bar) + len(info)
             if prev_total_width > self.total_width:
                 info += ((prev_total_width - self.total_width) * ' ')
-
-            sys.stdout.write(info)
+            sys.stdout.write(bar + info)
+            if finished:
+                sys.stdout.write('\n')
             sys.stdout.flush()
 
-            if current >= self.target:
-                sys.stdout.write('\n')
+        elif self.verbose == 1:
+            # One line per `line_percent` of progress.
+            line = self._count_format % current
+            if self.target is not None:
+                line += ' (%3d%%)' % (100. * current / self.target)
+                while self.next_line <= current:
+                    self.next_line += self.line_step
+            sys.stdout.write(line + self._info(current, now) + '\n')
+            sys.stdout.flush()
 
-        if self.verbose == 2:
-            if current >= self.target:
-                info = '%ds' % (now - self.start)
-                for k in self.unique_values:
-                    info += ' - %s:' % k
-                    avg = self.sum_values[k][0] / max(1, self.sum_values[k][1])
-                    if avg > 1e-3:
-                        info += ' %.4f' % avg
-                    else:
-                        info += ' %.4e' % avg
-                sys.stdout.write(info + "\n")
+        if self.verbose == 2 and finished:
+            info = '%ds' % (now - self.start)
+            for k in self.unique_values:
+                info += ' - %s:' % k
+                avg = self.sum_values[k][0] / max(1, self.sum_values[k][1])
+                if avg > 1e-3:
+                    info += ' %.4f' % avg
+                else:
+                    info += ' %.4e' % avg
+            sys.stdout.write(info + "\n")
 
         self.last_update = now
+        self.last_current = current
 
     def add(self, n, values=None):
         self.update(self.seen_so_far + n, values)
@@ -0,0 +1,224 @@
+"""Timers and counters around the stages of the data pipeline.
+
+Stages such as downloading, hashing, extracting, parsing, encoding and
+padding report how long they took as events to the registered sinks.
+Counters report what the stages did: the bytes downloaded
+(`download.bytes`), digests found in sidecars (`hash.cached`), members
+extracted (`extract.members`) or extractions skipped (`extract.skipped`),
+proteins and residues parsed (`parse.proteins`, `parse.residues`) and
+binary caches found in place (`cache.hits`).
+Without any sink, `timer` returns a shared no-op context manager and
+`count` returns at once, so instrumentation can stay in place.
+
+# Example
+
+```python
+    from dsppkeras.utils import instrumentation
+
+    summary = instrumentation.SummarySink()
+    instrumentation.add_sink(summary)
+    instrumentation.add_sink(instrumentation.JSONLinesSink('events.jsonl'))
+    X, Y = dspp.load_data()
+    print(summary.report())
+```
+"""
+from __future__ import absolute_import
+
+import collections
+import json
+import logging
+import sys
+import threading
+import time
+import timeit
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+_sinks = []
+_lock = threading.Lock()
+
+
+def peak_rss():
+    """Peak resident set size of this process in bytes, if known."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Reported in kilobytes on Linux and in bytes on macOS.
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def add_sink(sink):
+    """Starts sending events to `sink`, a callable taking an event dict."""
+    with _lock:
+        _sinks.append(sink)
+
+
+def remove_sink(sink):
+    """Stops sending events to `sink`."""
+    with _lock:
+        if sink in _sinks:
+            _sinks.remove(sink)
+
+
+def enabled():
+    """Whether any sink is registered."""
+    return bool(_sinks)
+
+
+def _emit(event):
+    for sink in list(_sinks):
+        sink(event)
+
+
+class _NullTimer(object):
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+    def update(self, **fields):
+        pass
+
+
+_NULL_TIMER = _NullTimer()
+
+
+class _Timer(object):
+
+    def __init__(self, name, fields):
+        self.name = name
+        self.fields = fields
+
+    def __enter__(self):
+        self.start = time.time()
+        self.clock = timeit.default_timer()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        event = collections.OrderedDict([
+            ('type', 'timer'), ('name', self.name), ('start', self.start),
+            ('seconds', timeit.default_timer() - self.clock),
+            ('peak_rss', peak_rss())])
+        if exc_type is not None:
+            event['error'] = exc_type.__name__
+        event.update(self.fields)
+        _emit(event)
+        return False
+
+    def update(self, **fields):
+        """Adds fields known only once the stage is running."""
+        self.fields.update(fields)
+
+
+def timer(name, **fields):
+    """Times the stage `name` as a context manager.
+
+    # Arguments
+        name: name of the stage, e.g. 'download' or 'encode'.
+        **fields: extra fields of the event, e.g. the number of proteins.
+
+    # Returns
+        A context manager, whose `update` method adds fields to the event.
+        The event is emitted when the stage ends, with its `start` time,
+        duration in `seconds` and the `peak_rss` of the process so far.
+    """
+    if not _sinks:
+        return _NULL_TIMER
+    return _Timer(name, fields)
+
+
+def count(name, value=1, **fields):
+    """Emits a counter event, e.g. the number of bytes downloaded."""
+    if not _sinks:
+        return
+    event = collections.OrderedDict([('type', 'counter'), ('name', name),
+                                     ('start', time.time()),
+                                     ('value', value)])
+    event.update(fields)
+    _emit(event)
+
+
+class LoggingSink(object):
+    """Logs every event.
+
+    # Arguments
+        logger: logger to use, defaults to the 'dsppkeras' logger.
+        level: logging level of the messages.
+    """
+
+    def __init__(self, logger=None, level=logging.INFO):
+        self.logger = logger or logging.getLogger('dsppkeras')
+        self.level = level
+
+    def __call__(self, event):
+        fields = ' '.join('{}={}'.format(key, value)
+                          for key, value in event.items()
+                          if key not in ('type', 'name', 'start', 'seconds',
+                                         'value'))
+        if event['type'] == 'timer':
+            self.logger.log(self.level, '%s took %.4f s %s', event['name'],
+                            event['seconds'], fields)
+        else:
+            self.logger.log(self.level, '%s: %s %s', event['name'],
+                            event['value'], fields)
+
+
+class JSONLinesSink(object):
+    """Appends every event as a line of JSON to a file.
+
+    # Arguments
+        path: path of the file.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, 'a')
+        self.lock = threading.Lock()
+
+    def __call__(self, event):
+        line = json.dumps(event, default=str)
+        with self.lock:
+            self.file.write(line + '\n')
+            self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+class SummarySink(object):
+    """Accumulates the number of events and total time of every stage."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.calls = collections.Counter()
+        self.seconds = collections.Counter()
+        self.values = collections.Counter()
+        self.peak_rss = 0
+
+    def __call__(self, event):
+        with self.lock:
+            self.calls[event['name']] += 1
+            if event['type'] == 'timer':
+                self.seconds[event['name']] += event['seconds']
+                self.peak_rss = max(self.peak_rss, event['peak_rss'] or 0)
+            else:
+                self.values[event['name']] += event['value']
+
+    def report(self):
+        """Formats the totals as a table."""
+        lines = ['{:<20}{:>8}{:>12}{:>14}'.format('stage', 'calls',
+                                                  'seconds', 'value')]
+        for name in sorted(self.calls):
+            lines.append('{:<20}{:>8}{:>12.4f}{:>14}'.format(
+                name, self.calls[name], self.seconds[name],
+                self.values.get(name, '')))
+        lines.append('peak RSS: {:.1f} MB'.format(self.peak_rss / 2. ** 20))
+        return '\n'.join(lines)
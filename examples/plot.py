@@ -7,6 +7,7 @@ Peptone Inc. - The Protein Intelligence Company (https://peptone.io)
 from __future__ import print_function
 
 from keras.models import model_from_json
+from dsppkeras.layers import OneHot
 from train import X, Y, weights
 import matplotlib
 matplotlib.use('Agg')
@@ -14,7 +15,7 @@ import matplotlib.pyplot as plt
 
 # load YAML and create model
 with open('model.json', 'r') as fp:
-    model = model_from_json(fp.read())
+    model = model_from_json(fp.read(), custom_objects={'OneHot': OneHot})
 
 # load weights into new model
 model.load_weights("model.h5")
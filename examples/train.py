@@ -11,12 +11,16 @@ from __future__ import print_function
 
 import keras
 from keras.models import Sequential
-from keras.layers import Dense
+from keras.layers import Dense, Flatten
 from keras.losses import logcosh
-from keras.preprocessing.sequence import pad_sequences
 
 from dsppkeras.datasets import dspp
-from utils import Struct, lettercode2onehot, shuffle_and_split, generate_weights, LossRatio, rmsd, chi2
+from dsppkeras.layers import OneHot
+from dsppkeras.preprocessing.sequence import encode_proteins
+from dsppkeras.preprocessing.sequence import gather_windows
+from dsppkeras.preprocessing.sequence import sliding_windows
+from dsppkeras.preprocessing.splitting import train_test_split
+from utils import Struct, LossRatio, rmsd, chi2
 
 def get_model(args):
     """
@@ -26,26 +30,37 @@ def get_model(args):
     with dSPP and structural propensities of proteins.
     """
     model = Sequential()
-    model.add(Dense(args.maxlen, input_shape=(20*args.maxlen,), name="Prediction"))
+    model.add(OneHot(input_shape=(args.maxlen,)))
+    model.add(Flatten())
+    model.add(Dense(args.maxlen, name="Prediction"))
     print(model.summary())
     return model
 
 # all free parameters for the model
 parameters = Struct(**{
     "maxlen": 800,
+    "overlap": 200,
 })
 
-X, Y = dspp.load_data()
-weights = generate_weights(Y)
-X = [lettercode2onehot(x) for x in X]
-X = pad_sequences(X, 20*parameters.maxlen)
-Y = pad_sequences(Y, parameters.maxlen, dtype='float32')
-weights = pad_sequences(weights, parameters.maxlen, dtype='float32')
+# Proteins longer than maxlen are cut into overlapping windows
+dataset = dspp.load_dataset()
+windows = sliding_windows(dataset.sequence_offsets, parameters.maxlen,
+                          parameters.overlap)
+X, offsets = gather_windows(dataset.sequences, dataset.sequence_offsets,
+                            windows)
+Y, _ = gather_windows(dataset.propensities, dataset.propensity_offsets,
+                      windows)
+X, Y, weights = encode_proteins(X, Y, offsets, maxlen=parameters.maxlen,
+                                sparse=True, dtype='int8')
 
 if __name__ == '__main__':
 
     # Shuffle and split the data
-    (x_train, y_train, weights_train), (x_test, y_test, weights_test) = shuffle_and_split(X, Y, weights)
+    # Windows of one protein stay on the same side of the split
+    train, test = train_test_split(len(X), fraction=0.8, seed=123456,
+                                   groups=windows[0])
+    (x_train, y_train, weights_train) = (X[train], Y[train], weights[train])
+    (x_test, y_test, weights_test) = (X[test], Y[test], weights[test])
 
     # Training parameters
     batch_size = 128
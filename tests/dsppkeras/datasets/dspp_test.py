@@ -0,0 +1,70 @@
+"""Tests for `dspp`."""
+from __future__ import absolute_import
+
+import io
+import json
+import random
+
+import pytest
+
+from dsppkeras.datasets import dspp
+
+
+def _random_value(rng, depth=0):
+    kind = rng.randint(0, 6 if depth < 2 else 4)
+    if kind == 0:
+        return rng.randint(-10 ** 6, 10 ** 6)
+    if kind == 1:
+        return rng.uniform(-1e3, 1e3) * 10 ** rng.randint(-8, 8)
+    if kind == 2:
+        return ''.join(rng.choice(u'ACDEé中"\\\n')
+                       for _ in range(rng.randint(0, 12)))
+    if kind == 3:
+        return rng.choice([True, False, None])
+    if kind == 4:
+        return [_random_value(rng, depth + 1)
+                for _ in range(rng.randint(0, 4))]
+    return {'k{}'.format(i): _random_value(rng, depth + 1)
+            for i in range(rng.randint(0, 3))}
+
+
+def _random_document(rng):
+    document = {}
+    for i in range(rng.randint(1, 5)):
+        if rng.random() < 0.3:
+            document['v{}'.format(i)] = _random_value(rng)
+        else:
+            document['a{}'.format(i)] = [_random_value(rng)
+                                         for _ in range(rng.randint(0, 8))]
+    return document
+
+
+def _expected(document):
+    return [(key, item) for key, value in document.items()
+            if isinstance(value, list) for item in value]
+
+
+@pytest.mark.parametrize('seed', range(30))
+def test_json_array_stream_chunk_sizes(seed):
+    rng = random.Random(seed)
+    document = _random_document(rng)
+    data = json.dumps(document, indent=rng.choice([None, 1]),
+                      ensure_ascii=rng.random() < 0.5).encode('utf-8')
+    expected = _expected(json.loads(data.decode('utf-8')))
+    for chunk_size in [1, 2, 3, 5, 7, 64, 1 << 16]:
+        stream = dspp._JSONArrayStream(io.BytesIO(data), chunk_size)
+        assert list(stream) == expected
+
+
+@pytest.mark.parametrize('chunk_size', [1, 2, 3, 4])
+def test_json_array_stream_numbers(chunk_size):
+    data = b'{"n": 12.5, "X": ["A"], "Y": [1.25, 2, -3e-2, 1E5]}'
+    stream = dspp._JSONArrayStream(io.BytesIO(data), chunk_size)
+    assert list(stream) == [('X', 'A'), ('Y', 1.25), ('Y', 2),
+                            ('Y', -0.03), ('Y', 1e5)]
+
+
+def test_json_array_stream_truncated():
+    stream = dspp._JSONArrayStream(io.BytesIO(b'{"X": ["A", "B"'), 3)
+    with pytest.raises(ValueError):
+        list(stream)
@@ -0,0 +1,63 @@
+"""Tests for `splitting`."""
+from __future__ import absolute_import
+
+import numpy as np
+import pytest
+
+from dsppkeras.preprocessing import splitting
+
+
+def _check_partition(n, train, test):
+    assert len(np.intersect1d(train, test)) == 0
+    np.testing.assert_array_equal(np.union1d(train, test), np.arange(n))
+
+
+@pytest.mark.parametrize('seed', range(20))
+def test_train_test_split_groups_fraction(seed):
+    # One large cluster and many singletons.
+    groups = np.concatenate([np.zeros(2000, dtype=np.int64),
+                             np.arange(1, 5201)])
+    n = len(groups)
+    train, test = splitting.train_test_split(n, fraction=0.8, seed=seed,
+                                             groups=groups)
+    _check_partition(n, train, test)
+    assert len(train) == int(round(0.8 * n))
+    assert not np.intersect1d(groups[train], groups[test]).size
+
+
+def test_train_test_split_groups_skip_large():
+    # The large group does not fit, the small one still goes to training.
+    groups = np.array([0] * 9 + [1])
+    train, test = splitting.train_test_split(10, fraction=0.8, seed=0,
+                                             groups=groups)
+    np.testing.assert_array_equal(train, [9])
+    np.testing.assert_array_equal(test, np.arange(9))
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_train_test_split_groups_clusters(seed):
+    rng = np.random.RandomState(seed)
+    groups = np.repeat(np.arange(500), rng.randint(1, 20, size=500))
+    n = len(groups)
+    train, test = splitting.train_test_split(n, fraction=0.8, seed=seed,
+                                             groups=groups)
+    _check_partition(n, train, test)
+    assert not np.intersect1d(groups[train], groups[test]).size
+    assert abs(len(train) - 0.8 * n) <= 1
+
+
+def test_train_test_split_lengths():
+    lengths = np.random.RandomState(0).randint(10, 1000, size=1000)
+    train, test = splitting.train_test_split(1000, fraction=0.8, seed=1,
+                                             lengths=lengths)
+    _check_partition(1000, train, test)
+    assert abs(len(train) - 800) <= 10
+
+
+def test_k_fold_groups():
+    groups = np.repeat(np.arange(50), 4)
+    folds = splitting.k_fold(len(groups), k=5, seed=0, groups=groups)
+    for train, test in folds:
+        _check_partition(len(groups), train, test)
+        assert not np.intersect1d(groups[train], groups[test]).size
+    assert sorted(len(test) for _, test in folds) == [40] * 5
@@ -0,0 +1,78 @@
+"""Tests for `cache_utils`."""
+from __future__ import absolute_import
+
+import itertools
+import os
+
+from dsppkeras.utils import cache_utils
+from dsppkeras.utils.cache_utils import ContentStore
+
+
+def _make_file(tmpdir, name, size):
+    fpath = str(tmpdir.join(name))
+    with open(fpath, 'wb') as f:
+        f.write(os.urandom(size))
+    return fpath
+
+
+def _store(tmpdir, monkeypatch, **kwargs):
+    # A clock advancing at every reading orders the accesses strictly.
+    clock = itertools.count(1000)
+    monkeypatch.setattr(cache_utils.time, 'time', lambda: next(clock))
+    return ContentStore(cache_subdir=str(tmpdir.join('store')), **kwargs)
+
+
+def test_add_and_find(tmpdir, monkeypatch):
+    store = _store(tmpdir, monkeypatch)
+    fpath = _make_file(tmpdir, 'a.bin', 1000)
+    with open(fpath, 'rb') as f:
+        data = f.read()
+    path = store.add(fpath, origin='http://example.com/a.bin')
+    assert not os.path.exists(fpath)
+    with open(path, 'rb') as f:
+        assert f.read() == data
+    assert store.find(name='a.bin') == path
+    digest = store.entries()[0]['digest']
+    assert store.find(digest=digest) == path
+    assert store.find(name='b.bin') is None
+
+
+def test_add_copy_keeps_file(tmpdir, monkeypatch):
+    store = _store(tmpdir, monkeypatch)
+    fpath = _make_file(tmpdir, 'a.bin', 1000)
+    path = store.add(fpath, move=False)
+    assert os.path.exists(fpath) and os.path.exists(path)
+    # Adding the same contents again keeps the file and the entry.
+    assert store.add(fpath, move=False) == path
+    assert os.path.exists(fpath)
+    assert len(store.entries()) == 1
+
+
+def test_lru_eviction(tmpdir, monkeypatch):
+    store = _store(tmpdir, monkeypatch, max_bytes=2500)
+    a = store.add(_make_file(tmpdir, 'a.bin', 1000))
+    b = store.add(_make_file(tmpdir, 'b.bin', 1000))
+    # Using a makes b the least recently used entry.
+    assert store.find(name='a.bin') == a
+    c = store.add(_make_file(tmpdir, 'c.bin', 1000))
+    names = [entry['name'] for entry in store.entries()]
+    assert names == ['a.bin', 'c.bin']
+    assert not os.path.exists(b)
+    assert os.path.exists(a) and os.path.exists(c)
+    assert sum(entry['size'] for entry in store.entries()) <= 2500
+
+
+def test_most_recent_entry_is_kept(tmpdir, monkeypatch):
+    store = _store(tmpdir, monkeypatch, max_bytes=500)
+    store.add(_make_file(tmpdir, 'a.bin', 1000))
+    b = store.add(_make_file(tmpdir, 'b.bin', 1000))
+    assert [entry['path'] for entry in store.entries()] == [b]
+
+
+def test_prune_older_than(tmpdir, monkeypatch):
+    store = _store(tmpdir, monkeypatch)
+    store.add(_make_file(tmpdir, 'a.bin', 100))
+    store.add(_make_file(tmpdir, 'b.bin', 100))
+    evicted = store.prune(older_than=0)
+    assert len(evicted) == 1
+    assert [entry['name'] for entry in store.entries()] == ['b.bin']
@@ -0,0 +1,264 @@
+"""Tests for downloads and archives with `data_utils`."""
+from __future__ import absolute_import
+
+import hashlib
+import json
+import multiprocessing
+import os
+import tarfile
+import threading
+import zipfile
+
+import pytest
+from six.moves import BaseHTTPServer
+from six.moves import socketserver
+
+from dsppkeras.datasets import dspp
+from dsppkeras.datasets import synthetic
+from dsppkeras.utils import data_utils
+from dsppkeras.utils import instrumentation
+
+
+class _Server(socketserver.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+
+class _RangeHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """Serves `server.data`, with byte ranges unless `server.ranges` is off."""
+
+    def do_GET(self):
+        server = self.server
+        data = server.data
+        server.requests.append(dict(self.headers.items()))
+        byte_range = self.headers.get('Range')
+        if_range = self.headers.get('If-Range')
+        if byte_range and server.ranges and if_range in (None, server.etag):
+            start, end = byte_range[len('bytes='):].split('-')
+            start = int(start)
+            end = min(int(end), len(data) - 1) if end else len(data) - 1
+            if start >= len(data):
+                self.send_response(416)
+                self.send_header('Content-Range',
+                                 'bytes */{}'.format(len(data)))
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+            body = data[start:end + 1]
+            self.send_response(206)
+            self.send_header('Content-Range', 'bytes {}-{}/{}'.format(
+                start, end, len(data)))
+        else:
+            body = data
+            self.send_response(200)
+        self.send_header('ETag', server.etag)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    server = _Server(('127.0.0.1', 0), _RangeHandler)
+    server.data = os.urandom(100000)
+    server.etag = '"v1"'
+    server.ranges = True
+    server.requests = []
+    server.url = 'http://127.0.0.1:{}/file.bin'.format(server.server_port)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def _write_part(fpath, data, validator):
+    with open(fpath + '.part', 'wb') as f:
+        f.write(data)
+    if validator is not None:
+        with open(fpath + '.part.json', 'w') as f:
+            json.dump({'validator': validator}, f)
+
+
+def _check_download(server, fpath, **kwargs):
+    hasher = hashlib.sha256()
+    data_utils._download(server.url, fpath, hasher=hasher, **kwargs)
+    with open(fpath, 'rb') as f:
+        assert f.read() == server.data
+    assert hasher.hexdigest() == hashlib.sha256(server.data).hexdigest()
+    assert not os.path.exists(fpath + '.part')
+    assert not os.path.exists(fpath + '.part.json')
+
+
+def test_full_download(server, tmpdir):
+    _check_download(server, str(tmpdir.join('file.bin')))
+    assert server.requests[0]['Range'] == 'bytes=0-'
+
+
+def test_parallel_download(server, tmpdir, monkeypatch):
+    monkeypatch.setattr(data_utils, '_RANGE_CHUNK_SIZE', 7000)
+    _check_download(server, str(tmpdir.join('file.bin')), connections=4)
+    assert len(server.requests) > 4
+
+
+def test_resume(server, tmpdir):
+    fpath = str(tmpdir.join('file.bin'))
+    _write_part(fpath, server.data[:30000], server.etag)
+    _check_download(server, fpath)
+    assert server.requests[0]['Range'] == 'bytes=30000-'
+    assert server.requests[0]['If-Range'] == server.etag
+
+
+def test_resume_complete_part(server, tmpdir):
+    fpath = str(tmpdir.join('file.bin'))
+    _write_part(fpath, server.data, server.etag)
+    _check_download(server, fpath)
+
+
+def test_resume_changed_file(server, tmpdir):
+    fpath = str(tmpdir.join('file.bin'))
+    _write_part(fpath, os.urandom(30000), '"v0"')
+    _check_download(server, fpath)
+
+
+def test_resume_without_validator(server, tmpdir):
+    fpath = str(tmpdir.join('file.bin'))
+    _write_part(fpath, os.urandom(30000), None)
+    _check_download(server, fpath)
+    assert server.requests[0]['Range'] == 'bytes=0-'
+
+
+def test_server_ignores_range(server, tmpdir):
+    server.ranges = False
+    fpath = str(tmpdir.join('file.bin'))
+    _write_part(fpath, os.urandom(30000), server.etag)
+    _check_download(server, fpath)
+    # Several connections fall back to a single one.
+    os.remove(fpath)
+    _write_part(fpath, server.data[:30000], server.etag)
+    _check_download(server, fpath, connections=4)
+
+
+def test_get_file(server, tmpdir):
+    fpath = data_utils.get_file(
+        'file.bin', server.url, cache_subdir=str(tmpdir),
+        file_hash=hashlib.sha256(server.data).hexdigest())
+    with open(fpath, 'rb') as f:
+        assert f.read() == server.data
+    # Found in place the second time.
+    requests = len(server.requests)
+    data_utils.get_file('file.bin', server.url, cache_subdir=str(tmpdir))
+    assert len(server.requests) == requests
+
+
+def _make_zip(fpath, members, directories=()):
+    with zipfile.ZipFile(fpath, 'w') as archive:
+        for name in directories:
+            archive.writestr(name + '/', b'')
+        for name, data in members.items():
+            archive.writestr(name, data)
+
+
+def test_extract_zip_nested_directories(tmpdir):
+    members = {'data/{}/sub/{}.txt'.format(i, j): os.urandom(100)
+               for i in range(100) for j in range(4)}
+    fpath = str(tmpdir.join('a.zip'))
+    _make_zip(fpath, members, directories=['data/empty/dir'])
+    path = str(tmpdir.join('out'))
+    assert data_utils._extract_archive(fpath, path, workers=8)
+    for name, data in members.items():
+        with open(os.path.join(path, name), 'rb') as f:
+            assert f.read() == data
+    assert os.path.isdir(os.path.join(path, 'data', 'empty', 'dir'))
+    assert not [name for name in os.listdir(path) if name.startswith('.')]
+
+
+def test_extract_merges_into_existing_directories(tmpdir):
+    path = tmpdir.join('out')
+    path.join('data').ensure(dir=True)
+    path.join('data', 'other.csv').write('keep')
+    path.join('data', 'new.txt').write('old')
+    fpath = str(tmpdir.join('a.zip'))
+    _make_zip(fpath, {'data/new.txt': b'new'})
+    assert data_utils._extract_archive(fpath, str(path))
+    assert path.join('data', 'other.csv').read() == 'keep'
+    assert path.join('data', 'new.txt').read() == 'new'
+
+
+def test_extract_tar_only_once(tmpdir):
+    source = tmpdir.join('source')
+    source.join('data', 'sub').ensure(dir=True)
+    source.join('data', 'sub', 'a.txt').write('a')
+    fpath = str(tmpdir.join('a.tar.gz'))
+    with tarfile.open(fpath, 'w:gz') as archive:
+        archive.add(str(source.join('data')), arcname='data')
+    path = tmpdir.join('out')
+    assert data_utils._extract_archive(fpath, str(path))
+    assert path.join('data', 'sub', 'a.txt').read() == 'a'
+    # Unchanged archives are not extracted again, unless members are gone.
+    mtime = os.path.getmtime(str(path.join('data', 'sub', 'a.txt')))
+    assert data_utils._extract_archive(fpath, str(path))
+    assert os.path.getmtime(str(path.join('data', 'sub', 'a.txt'))) == mtime
+    path.join('data', 'sub', 'a.txt').remove()
+    assert data_utils._extract_archive(fpath, str(path))
+    assert path.join('data', 'sub', 'a.txt').read() == 'a'
+
+
+def _fetch_and_convert(url, datadir, log_path, barrier):
+    build_cache = dspp._build_cache
+
+    def counted_build_cache(path, cache_path):
+        with open(log_path, 'a') as f:
+            f.write('build\n')
+        build_cache(path, cache_path)
+
+    dspp._build_cache = counted_build_cache
+    barrier.wait()
+    path = data_utils.get_file('a.tar.gz', url, cache_subdir=datadir)
+    assert len(dspp.load_dataset(path)) == 20
+
+
+@pytest.mark.skipif(data_utils.fcntl is None or
+                    'fork' not in multiprocessing.get_all_start_methods(),
+                    reason='needs flock and fork')
+def test_concurrent_get_file_and_cache(server, tmpdir):
+    fpath = synthetic.make_archive(str(tmpdir.join('origin.tar.gz')),
+                                   num_proteins=20, seed=0)
+    with open(fpath, 'rb') as f:
+        server.data = f.read()
+    datadir = str(tmpdir.join('datasets'))
+    log_path = str(tmpdir.join('builds.log'))
+    context = multiprocessing.get_context('fork')
+    barrier = context.Barrier(8)
+    processes = [context.Process(target=_fetch_and_convert,
+                                 args=(server.url, datadir, log_path,
+                                       barrier))
+                 for _ in range(8)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join(60)
+        assert process.exitcode == 0
+    assert len(server.requests) == 1
+    with open(log_path) as f:
+        assert f.read().count('build') == 1
+
+
+def test_download_counters(server, tmpdir):
+    summary = instrumentation.SummarySink()
+    instrumentation.add_sink(summary)
+    try:
+        fpath = str(tmpdir.join('file.bin'))
+        _write_part(fpath, server.data[:30000], server.etag)
+        _check_download(server, fpath)
+        # The second time the digest comes from the sidecar.
+        data_utils._hash_file(fpath)
+        data_utils._hash_file(fpath)
+    finally:
+        instrumentation.remove_sink(summary)
+    assert summary.values['download.bytes'] == len(server.data) - 30000
+    assert summary.calls['download.bytes'] == 1
+    assert summary.values['hash.cached'] == 1